@@ -0,0 +1,259 @@
+"""Benchmark of the action stages on a synthetic repository.
+
+Usage:
+    python benchmarks/bench.py --notebooks 500 --mds 500 --out baseline.json
+    python benchmarks/bench.py --notebooks 500 --mds 500 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+
+import lib  # noqa: E402
+from fake_github import FakeGitHub  # noqa: E402
+
+STAGES = ("discovery", "resolve", "read", "check", "write", "remote")
+
+
+class Config(NamedTuple):
+    notebooks: int = 200
+    mds: int = 200
+    cells: int = 20
+    badge_density: float = 0.2
+    tracked_ratio: float = 0.5
+    output_size: int = 1024
+    lazy: bool = True
+    seed: int = 0
+    remote_links: int = 100
+    latency: float = 0.02
+    concurrency: int = 8
+
+
+class Stage(NamedTuple):
+    seconds: float
+    files: int
+    bytes: int
+
+    def report(self) -> dict:
+        seconds = max(self.seconds, 1e-9)
+        return {
+            **self._asdict(),
+            "files_per_s": round(self.files / seconds, 1),
+            "mb_per_s": round(self.bytes / seconds / 2**20, 2),
+        }
+
+
+def make_badge_line(rng: random.Random, config: Config, badge: lib.Badge, targets: List[str], self_badge: bool) -> str:
+    """Badge tag, or a tracked badge (with an outdated link, so it gets updated)."""
+    target = "" if self_badge else rng.choice(targets)
+    if rng.random() < config.tracked_ratio:
+        url = badge.url.safe_substitute(repo="old/repo", branch="old", file=target or "old.ipynb")
+        return badge.html.safe_substitute(url=url) + "\n"
+    return "{{ badge " + target + " }}\n" if target else "{{ badge }}\n"
+
+
+def make_text(rng: random.Random, config: Config, badge: lib.Badge, targets: List[str], self_badge: bool) -> List[str]:
+    """Markdown lines, some of them with badges."""
+    lines = []
+    for i in range(8):
+        if rng.random() < config.badge_density:
+            lines.append(make_badge_line(rng, config, badge, targets, self_badge))
+        else:
+            lines.append(f"Some text of the line {i}, with a [link](https://example.com/{i}) and `code`.\n")
+    lines[-1] = lines[-1].rstrip("\n")
+    return lines
+
+
+def make_notebook(rng: random.Random, config: Config, badge: lib.Badge, targets: List[str]) -> dict:
+    cells: List[dict] = []
+    for i in range(config.cells):
+        if i % 2 == 0:
+            source = make_text(rng, config, badge, targets, self_badge=i == 0)
+            cells.append({"cell_type": "markdown", "metadata": {}, "source": source})
+        else:
+            output = {"output_type": "display_data", "metadata": {}, "data": {"image/png": "A" * config.output_size}}
+            cells.append(
+                {
+                    "cell_type": "code",
+                    "execution_count": i,
+                    "metadata": {},
+                    "outputs": [output],
+                    "source": [f"x = {i}\n", "print(x)"],
+                }
+            )
+    return {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+
+
+def generate(root: str, config: Config) -> None:
+    """Generates a repository: notebooks and markdown files (linking to the notebooks) in nested directories."""
+    rng, badge = random.Random(config.seed), lib.Badge()
+    nbs = [f"nbs/d{i % 10}/nb{i}.ipynb" for i in range(config.notebooks)]
+    mds = [f"docs/d{i % 10}/md{i}.md" for i in range(config.mds)]
+    targets = [nb[: -len(".ipynb")] for nb in nbs] or ["missing"]
+    for nb in nbs:
+        os.makedirs(os.path.join(root, os.path.dirname(nb)), exist_ok=True)
+        with open(os.path.join(root, nb), "w") as fp:
+            json.dump(make_notebook(rng, config, badge, targets), fp, indent=1)
+    for md in mds:
+        os.makedirs(os.path.join(root, os.path.dirname(md)), exist_ok=True)
+        with open(os.path.join(root, md), "w") as fp:
+            fp.writelines(make_text(rng, config, badge, targets, self_badge=False))
+    if shutil.which("git"):
+        subprocess.run(["git", "init", "-q"], cwd=root, check=True)
+
+
+def run_stages(root: str, config: Config) -> Dict[str, Stage]:
+    """Runs the stages of the action one after another (in a single process), timing each of them. Files are
+    resolved and processed as in the action (resolve_files, process_file), stages of processing are its spans.
+    """
+    cwd = os.getcwd()
+    os.chdir(root)
+    outer = lib.stats
+    try:
+        badge, patterns = lib.Badge(), lib.Patterns()
+        run_stats = lib.setup_stats(True)
+        assert run_stats is not None
+
+        start = time.perf_counter()
+        repo_files = lib.get_all_files((".ipynb", ".md"))
+        lib.setup_nb_index(path for path in repo_files if path.endswith(".ipynb"))
+        paths = lib.filter_badge_files(repo_files)
+        discovery = Stage(time.perf_counter() - start, len(repo_files), 0)
+
+        file = lib.File(path="", type="md", track=True, branch="main", repo="user/repo")
+        files = [file._replace(path=path, type="md" if path.endswith(".md") else "notebook") for path in paths]
+        size = sum(os.path.getsize(path) for path in paths)
+        start = time.perf_counter()
+        lib.resolve_files(files, badge, patterns, lazy=config.lazy)
+        resolve = Stage(time.perf_counter() - start, len(files), size)
+
+        for file in files:
+            result = lib.process_file(file, badge, patterns, lazy=config.lazy)
+            run_stats.merge(result.stats)
+        timings, counters = run_stats.timings, run_stats.counters
+        read = Stage(timings.get("read", 0.0), counters.get("files_read", 0), counters.get("bytes_read", 0))
+        check = Stage(timings.get("check", 0.0), counters.get("files_read", 0), counters.get("bytes_read", 0))
+        written = counters.get("files_written", 0)
+        write = Stage(timings.get("write", 0.0), written, counters.get("bytes_written", 0))
+    finally:
+        os.chdir(cwd)
+        lib.stats = outer
+        lib.nb_index = None
+    return dict(zip(STAGES, (discovery, resolve, read, check, write, run_remote(config))))
+
+
+def reset_caches() -> None:
+    """Clears the results kept by the action between files (a fresh run starts from scratch)."""
+    for cache in (lib.resolved, lib.checked_links, lib.located, lib.parsed):
+        cache.clear()
+    lib.append_ext_to_str.cache_clear()
+    lib.get_self_url.cache_clear()
+
+
+def run_remote(config: Config) -> Stage:
+    """Checks distinct remote links against a local stand-in server (with latency), files are links here."""
+    links = [f"/user/repo/blob/main/nb{i}.ipynb" for i in range(config.remote_links)]
+    with FakeGitHub(latency=config.latency) as server:
+        scheduler = lib.RemoteScheduler(concurrency=config.concurrency, host=server.host)
+        start = time.perf_counter()
+        futures = [scheduler.submit(link) for link in links]
+        for future in futures:
+            future.result()
+        seconds = time.perf_counter() - start
+        scheduler.pool.close()
+    return Stage(seconds, len(links), 0)
+
+
+def benchmark(config: Config, repeat: int = 3) -> dict:
+    """Best (min) time of each stage, a fresh repository is generated for every run."""
+    best: Dict[str, Stage] = {}
+    for _ in range(repeat):
+        root = tempfile.mkdtemp(prefix="colab-badge-bench-")
+        reset_caches()
+        try:
+            generate(root, config)
+            for name, stage in run_stages(root, config).items():
+                if name not in best or stage.seconds < best[name].seconds:
+                    best[name] = stage
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    return {
+        "config": config._asdict(),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "stages": {name: best[name].report() for name in STAGES},
+    }
+
+
+def get_commit() -> Optional[str]:
+    res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, capture_output=True)
+    return res.stdout.decode().strip() if res.returncode == 0 else None
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """Table of the stages timings: current results vs baseline."""
+    rows = [f"{'stage':<10} {'baseline, s':>12} {'current, s':>12} {'ratio':>7}"]
+    for name in STAGES:
+        if name not in baseline["stages"]:
+            continue
+        old, new = baseline["stages"][name]["seconds"], results["stages"][name]["seconds"]
+        rows.append(f"{name:<10} {old:>12.4f} {new:>12.4f} {new / max(old, 1e-9):>7.2f}")
+    if baseline["config"] != results["config"]:
+        rows.append("Warning: configs of the results differ.")
+    return "\n".join(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    defaults = Config()
+    parser = argparse.ArgumentParser(description="Benchmark of the action on a synthetic repository.")
+    parser.add_argument("--notebooks", type=int, default=defaults.notebooks, help="number of notebooks")
+    parser.add_argument("--mds", type=int, default=defaults.mds, help="number of markdown files")
+    parser.add_argument("--cells", type=int, default=defaults.cells, help="cells per notebook (half are markdown)")
+    parser.add_argument("--badge-density", type=float, default=defaults.badge_density, help="share of badge lines")
+    parser.add_argument("--tracked-ratio", type=float, default=defaults.tracked_ratio, help="share of tracked badges")
+    parser.add_argument("--output-size", type=int, default=defaults.output_size, help="bytes of code cell output")
+    parser.add_argument("--eager", action="store_true", help="decode notebooks as a whole (lazy_notebooks: false)")
+    parser.add_argument("--remote-links", type=int, default=defaults.remote_links, help="remote links to check")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="latency of the remote server, s")
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency, help="concurrent remote requests")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best one is reported")
+    parser.add_argument("--out", help="JSON file to write results to (baseline)")
+    parser.add_argument("--compare", help="JSON file with baseline results to compare with")
+    args = parser.parse_args(argv)
+
+    config = Config(
+        notebooks=args.notebooks,
+        mds=args.mds,
+        cells=args.cells,
+        badge_density=args.badge_density,
+        tracked_ratio=args.tracked_ratio,
+        output_size=args.output_size,
+        lazy=not args.eager,
+        seed=args.seed,
+        remote_links=args.remote_links,
+        latency=args.latency,
+        concurrency=args.concurrency,
+    )
+    results = benchmark(config, args.repeat)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as fp:
+            json.dump(results, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            print(compare(results, json.load(fp)))
+
+
+if __name__ == "__main__":
+    main()
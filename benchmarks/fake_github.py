@@ -0,0 +1,236 @@
+"""Local stand-in for github.com to test and benchmark checks of remote notebooks offline.
+
+Usage (standalone):
+    python benchmarks/fake_github.py --port 8000 --latency 0.05 --status /usr/repo/blob/main/nb.ipynb=404
+and then run the action with `remote_host: http://localhost:8000`. Repo trees (GitHub API) are listed with
+    python benchmarks/fake_github.py --port 8000 --tree usr/repo/main=nb.ipynb,nbs/nb2.ipynb
+and `remote_api_host: http://localhost:8000`.
+"""
+import argparse
+import hashlib
+import json
+import socket
+import ssl
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Union
+from urllib.parse import unquote
+
+
+class FakeGitHub:
+    """HTTP(S) server answering HEAD/GET requests with configurable behaviour.
+
+    Args:
+        latency: delay (in seconds) before each response.
+        statuses: status code per path, or a sequence of codes (one per request, the last one is repeated).
+        default_status: status code of the rest of the paths.
+        rate_limit: number of requests allowed per rate_window seconds (X-RateLimit-* headers), None for no limit.
+        rate_window: rate limit window, in seconds.
+        retry_after: answer rate limited requests with 429 and Retry-After header (otherwise 403, as GitHub does).
+        resets: paths, which connections are reset, each time (True) or for the given number of requests.
+        certfile: certificate (with a key) to serve HTTPS, clients have to trust it (e.g. with SSL_CERT_FILE).
+        trees: files of repo trees ("owner/repo/ref" -> paths), listed with GET /repos/<owner>/<repo>/git/trees/<ref>
+            (as with GitHub API), trees of other refs are not found (404).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        statuses: Optional[Dict[str, Union[int, List[int]]]] = None,
+        default_status: int = 200,
+        rate_limit: Optional[int] = None,
+        rate_window: float = 60.0,
+        retry_after: bool = False,
+        resets: Optional[Dict[str, Union[bool, int]]] = None,
+        certfile: Optional[str] = None,
+        trees: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        self.latency = latency
+        self.statuses = {
+            path: [*status] if isinstance(status, list) else [status] for path, status in (statuses or {}).items()
+        }
+        self.default_status = default_status
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.retry_after = retry_after
+        self.resets = dict(resets or {})
+        self.certfile = certfile
+        self.trees = trees
+        # Requests received: (method, path, headers).
+        self.requests: List[tuple] = []
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.window_count = 0
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        """Host to be used by the remote scheduler (host setting)."""
+        assert self.server is not None, "Server is not started"
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}" if self.certfile else f"http://{host}:{port}"
+
+    def start(self, port: int = 0) -> "FakeGitHub":
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(self))
+        self.server.daemon_threads = True
+        if self.certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), name="fake-github", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self) -> "FakeGitHub":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def count(self, path: Optional[str] = None) -> int:
+        """Number of requests received (for the path)."""
+        return sum(1 for request in self.requests if path is None or request[1] == path)
+
+    def respond(self, method: str, path: str, headers: Dict[str, str]) -> Optional[tuple]:
+        """Returns (status, headers) of the response, None to reset the connection."""
+        with self.lock:
+            self.requests.append((method, path, headers))
+            reset = self.resets.get(path)
+            if reset:
+                if reset is not True:
+                    self.resets[path] = reset - 1
+                return None
+            now = time.time()
+            if now - self.window_start >= self.rate_window:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            reset_time = int(self.window_start + self.rate_window)
+            response_headers = {}
+            if self.rate_limit is not None:
+                remaining = max(0, self.rate_limit - self.window_count)
+                response_headers = {
+                    "X-RateLimit-Limit": str(self.rate_limit),
+                    "X-RateLimit-Remaining": str(remaining),
+                    "X-RateLimit-Reset": str(reset_time),
+                }
+                if self.window_count > self.rate_limit:
+                    if self.retry_after:
+                        return 429, {**response_headers, "Retry-After": str(max(0, int(reset_time - now)))}
+                    return 403, response_headers
+            statuses = self.statuses.get(path)
+            status = (statuses.pop(0) if len(statuses) > 1 else statuses[0]) if statuses else self.default_status
+            if not statuses and self.trees is not None and self.tree_key(path) is not None:
+                status = 200 if self.tree_key(path) in self.trees else 404
+        if status < 400:
+            etag = '"' + hashlib.sha1(path.encode()).hexdigest()[:16] + '"'
+            response_headers["ETag"] = etag
+            if headers.get("If-None-Match") == etag:
+                status = 304
+        return status, response_headers
+
+    def tree_key(self, path: str) -> Optional[str]:
+        """Returns "owner/repo/ref" of a tree listing request, None for other requests."""
+        parts = path.split("?")[0].split("/")
+        if len(parts) == 7 and parts[1] == "repos" and parts[4:6] == ["git", "trees"]:
+            return "/".join((parts[2], parts[3], unquote(parts[6])))
+        return None
+
+    def listing(self, path: str) -> Optional[bytes]:
+        """Returns body of a tree listing response (JSON), None for other requests."""
+        key = self.tree_key(path)
+        if self.trees is None or key not in self.trees:
+            return None
+        tree = [{"path": file, "type": "blob"} for file in self.trees[key]]
+        return json.dumps({"sha": "0" * 40, "tree": tree, "truncated": False}).encode()
+
+
+def make_handler(fake: FakeGitHub) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive connections.
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self) -> None:
+            self.answer(body=False)
+
+        def do_GET(self) -> None:
+            self.answer(body=True)
+
+        def answer(self, body: bool) -> None:
+            if fake.latency:
+                time.sleep(fake.latency)
+            response = fake.respond(self.command, self.path, dict(self.headers))
+            if response is None:
+                # Close without a response, with RST instead of FIN.
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                self.close_connection = True
+                return
+            status, headers = response
+            content = f"{status}\n".encode() if body and status != 304 else b""
+            if body and status == 200:
+                content = fake.listing(self.path) or content
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for github.com.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="delay before each response, in seconds")
+    parser.add_argument("--status", action="append", default=[], help="status of a path: PATH=CODE[,CODE...]")
+    parser.add_argument("--default-status", type=int, default=200)
+    parser.add_argument("--rate-limit", type=int, help="requests allowed per window")
+    parser.add_argument("--rate-window", type=float, default=60.0, help="rate limit window, in seconds")
+    parser.add_argument("--retry-after", action="store_true", help="answer rate limited requests with 429")
+    parser.add_argument("--reset", action="append", default=[], help="path to reset connections of")
+    parser.add_argument("--certfile", help="certificate (with a key) to serve HTTPS")
+    parser.add_argument("--tree", action="append", default=[], help="repo tree: OWNER/REPO/REF=PATH[,PATH...]")
+    args = parser.parse_args()
+
+    statuses = {}
+    for item in args.status:
+        path, _, codes = item.rpartition("=")
+        statuses[path] = [int(code) for code in codes.split(",")]
+    trees = {}
+    for item in args.tree:
+        key, _, paths = item.partition("=")
+        trees[key] = paths.split(",")
+    fake = FakeGitHub(
+        latency=args.latency,
+        statuses=statuses,
+        default_status=args.default_status,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        retry_after=args.retry_after,
+        resets={path: True for path in args.reset},
+        certfile=args.certfile,
+        trees=trees or None,
+    )
+    fake.start(args.port)
+    print(f"Serving on {fake.host}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,34 @@
+import json
 import logging
 import os
+from functools import partial
 
 from lib import (
     Badge,
     File,
+    Manifest,
     Patterns,
-    check_cells,
-    check_md,
-    get_all_mds,
+    count,
+    filter_badge_files,
+    filter_globs,
+    get_all_files,
     get_all_nbs,
-    get_modified_mds,
-    get_modified_nbs,
-    read_file,
-    write_file,
+    get_blob_ids,
+    get_modified_files,
+    get_push_range,
+    get_ref_files,
+    get_tool_version,
+    get_workers,
+    split_globs,
+    link_cache,
+    process_files,
+    profile_run,
+    resolve_files,
+    setup_mirrors,
+    setup_nb_index,
+    setup_scheduler,
+    setup_stats,
+    span,
 )
 
 
@@ -24,7 +40,26 @@ def setup_logger(name, formatter):
     return logger
 
 
+def list_target_nbs(target_branch, current_branch):
+    """Lists notebooks of the target branch (of the current one if there is no such branch)."""
+    if target_branch != current_branch:
+        target_nbs = get_ref_files(target_branch, (".ipynb",))
+        if target_nbs is not None:
+            return target_nbs
+        logging.getLogger("action").warning(
+            f"No branch {target_branch}, local badges are checked against {current_branch}"
+        )
+    return get_all_nbs()
+
+
 def main():
+    # Profiling mode: CPU profile and memory allocations are written to this directory (disabled if empty).
+    PROFILE = os.environ["INPUT_PROFILE"]
+    with profile_run(PROFILE):
+        run(profile=bool(PROFILE))
+
+
+def run(profile=False):
     # Set repository
     CURRENT_REPOSITORY = os.environ["GITHUB_REPOSITORY"]
     TARGET_REPOSITORY = os.environ["INPUT_TARGET_REPOSITORY"] or CURRENT_REPOSITORY
@@ -35,16 +70,50 @@ def main():
     TARGET_BRANCH = os.environ["INPUT_TARGET_BRANCH"] or CURRENT_BRANCH
     # Check all or latest
     CHECK = os.environ["INPUT_CHECK"]  # "all" | "latest"
+    # Commits to check with "latest": input, pushed commits, or just the current one.
+    COMMIT_RANGE = os.environ["INPUT_COMMIT_RANGE"] or get_push_range(os.environ.get("GITHUB_EVENT_PATH"))
+    # Files to check / to skip (glob patterns).
+    INCLUDE = split_globs(os.environ["INPUT_INCLUDE"])
+    EXCLUDE = split_globs(os.environ["INPUT_EXCLUDE"])
     # Track badges info (works only for notebooks with "self-badges").
     TRACK = {"true": True, "false": False}.get(os.environ["INPUT_UPDATE"], True)  # True | False
     VERBOSE = {"true": True, "false": False}.get(os.environ["INPUT_VERBOSE"], False)  # True | False
+    # Number of worker processes.
+    WORKERS = get_workers(os.environ["INPUT_WORKERS"])  # "auto" | int
+    # Profile covers a single process.
+    WORKERS = 1 if profile else WORKERS
+    # Manifest of processed files (incremental mode, disabled if empty).
+    MANIFEST = os.environ["INPUT_MANIFEST"]
+    # Decode only markdown cells of notebooks, the rest is kept as is.
+    LAZY = {"true": True, "false": False}.get(os.environ["INPUT_LAZY_NOTEBOOKS"], True)  # True | False
+    # Link cache file (disabled if empty) and its entries lifetime (in seconds).
+    LINK_CACHE = os.environ["INPUT_LINK_CACHE"]
+    LINK_CACHE_TTL = float(os.environ["INPUT_LINK_CACHE_TTL"])
+    LINK_CACHE_NEGATIVE_TTL = float(os.environ["INPUT_LINK_CACHE_NEGATIVE_TTL"])
+    # Remote links checks: max concurrent requests, request timeout, overall time budget (in seconds), retries.
+    REMOTE_CONCURRENCY = int(os.environ["INPUT_REMOTE_CONCURRENCY"])
+    REMOTE_TIMEOUT = float(os.environ["INPUT_REMOTE_TIMEOUT"])
+    REMOTE_BUDGET = float(os.environ["INPUT_REMOTE_BUDGET"])
+    REMOTE_RETRIES = int(os.environ["INPUT_REMOTE_RETRIES"])
+    # Host to check remote links against (e.g. a local stand-in server: "http://localhost:8000").
+    REMOTE_HOST = os.environ["INPUT_REMOTE_HOST"]
+    # GitHub API host to list trees of remote repos with, empty to check remote links one by one.
+    REMOTE_API_HOST = os.environ["INPUT_REMOTE_API_HOST"]
+    # Token of GitHub API requests (listings of trees), empty for unauthenticated ones.
+    TOKEN = os.environ["INPUT_TOKEN"]
+    # Local mirrors of remote repos (owner/repo=path), remote links of these repos are checked with git.
+    REMOTE_MIRRORS = split_globs(os.environ["INPUT_REMOTE_MIRRORS"])
+    # Run stats: summary (markdown table) and JSON report (if the path is set).
+    STATS_FILE = os.environ["INPUT_STATS_FILE"]
+    STATS = {"true": True, "false": False}.get(os.environ["INPUT_STATS"], False) or bool(STATS_FILE)  # True | False
+    GITHUB_STEP_SUMMARY = os.environ.get("GITHUB_STEP_SUMMARY")
 
     logger_action = setup_logger(
         "action",
         logging.Formatter(fmt="%(asctime)s %(levelname)s %(message)s", datefmt="%d-%b-%y %H:%M:%S"),
     )
 
-    logger_badge = setup_logger(
+    setup_logger(
         "badge",
         logging.Formatter(fmt="::%(levelname)s file=%(file)s,line=%(line)s,title=%(title)s::%(message)s"),
     )
@@ -52,43 +121,84 @@ def main():
     if VERBOSE:
         logger_action.setLevel(logging.INFO)
 
-    if CHECK == "all":
-        logger_action.info("Getting list of all files...")
-        nbs, mds = get_all_nbs(), get_all_mds()
-    elif CHECK == "latest":
-        logger_action.info("Getting list of latest modified files...")
-        nbs, mds = get_modified_nbs(), get_modified_mds()
-    else:
-        raise ValueError(f"{CHECK} is a wrong value. Expecting all or latest")
+    stats = setup_stats(STATS)
+
+    with span("discovery"):
+        if CHECK == "all":
+            logger_action.info("Getting list of all files...")
+            all_files = get_all_files((".ipynb", ".md"), include=INCLUDE, exclude=EXCLUDE)
+            nbs, mds = [f for f in all_files if f.endswith(".ipynb")], [f for f in all_files if f.endswith(".md")]
+        elif CHECK == "latest":
+            logger_action.info(f"Getting list of latest modified files ({COMMIT_RANGE or 'HEAD'})...")
+            nbs, mds = get_modified_files(COMMIT_RANGE)
+            nbs, mds = filter_globs(nbs, INCLUDE, EXCLUDE), filter_globs(mds, INCLUDE, EXCLUDE)
+        else:
+            raise ValueError(f"{CHECK} is a wrong value. Expecting all or latest")
+
+        logger_action.info(f"Files: {', '.join(nbs + mds)}")
+
+        # Local badges are checked against all the notebooks of the repo (including skipped ones), listed on the
+        # first local badge. Badges link to the target branch: its tree is listed (if it is another branch).
+        setup_nb_index(loader=partial(list_target_nbs, TARGET_BRANCH, CURRENT_BRANCH))
+    count("files_discovered", len(nbs) + len(mds))
 
-    logger_action.info(f"Files: {', '.join(nbs + mds)}")
+    # Skip files processed already (unchanged files, with the same inputs).
+    with span("manifest"):
+        manifest = Manifest(MANIFEST)
+        manifest.load()
+        inputs = {"repo": TARGET_REPOSITORY, "branch": TARGET_BRANCH, "track": TRACK, "version": get_tool_version()}
+        blobs = get_blob_ids() if MANIFEST else {}
+        nbs = [nb for nb in nbs if not manifest.is_up_to_date(nb, blobs.get(nb), inputs)]
+        mds = [md for md in mds if not manifest.is_up_to_date(md, blobs.get(md), inputs)]
+
+    # Skip files without badge tags and tracked badges.
+    with span("prefilter"):
+        with_badges = set(filter_badge_files(nbs + mds))
+        nbs, mds = [nb for nb in nbs if nb in with_badges], [md for md in mds if md in with_badges]
+    count("files_with_badges", len(nbs) + len(mds))
+    logger_action.info(f"Files with badges: {', '.join(nbs + mds)}")
 
     badge, patterns = Badge(), Patterns()
 
-    if nbs:
-        for nb in nbs:
-            logger_action.info(f"{nb}: Reading...")
-            nb_data = read_file(nb)
-            file = File(path=nb, type="notebook", track=TRACK, branch=TARGET_BRANCH, repo=TARGET_REPOSITORY)
-            cells = check_cells(cells=nb_data["cells"], file=file, badge=badge, patterns=patterns, logger=logger_badge)
-            if cells:
-                logger_action.info(f"{nb} Saving...")
-                nb_data["cells"] = cells
-                write_file(nb_data, nb)
-            else:
-                logger_action.info(f"{nb}: Nothing to add...")
-    if mds:
-        for md in mds:
-            logger_action.info(f"{md}: Reading...")
-            md_data = read_file(md)
-            file = File(path=md, type="md", track=TRACK, branch=TARGET_BRANCH, repo=TARGET_REPOSITORY)
-            text = check_md(text=[*md_data], file=file, badge=badge, patterns=patterns, logger=logger_badge)
-            if text:
-                logger_action.info(f"{md} Saving...")
-                md_data = text
-                write_file(md_data, md)
-            else:
-                logger_action.info(f"{md}: Nothing to add...")
+    link_cache.path, link_cache.ttl, link_cache.negative_ttl = LINK_CACHE, LINK_CACHE_TTL, LINK_CACHE_NEGATIVE_TTL
+    link_cache.load()
+    setup_scheduler(
+        REMOTE_CONCURRENCY, REMOTE_TIMEOUT, REMOTE_BUDGET, REMOTE_RETRIES, REMOTE_HOST, REMOTE_API_HOST, TOKEN
+    )
+    setup_mirrors(REMOTE_MIRRORS)
+
+    files = [
+        *(File(path=nb, type="notebook", track=TRACK, branch=TARGET_BRANCH, repo=TARGET_REPOSITORY) for nb in nbs),
+        *(File(path=md, type="md", track=TRACK, branch=TARGET_BRANCH, repo=TARGET_REPOSITORY) for md in mds),
+    ]
+    # Badge targets of all the files are resolved at once, before badges are applied.
+    with span("resolve"):
+        resolve_files(files, badge, patterns, lazy=LAZY)
+
+    # Records are replayed per file, in input order (the same output as with a single worker).
+    with span("process"):
+        results = process_files(files, badge, patterns, verbose=VERBOSE, workers=WORKERS, lazy=LAZY)
+        for file, result in zip(files, results):
+            for record in result.records:
+                logging.getLogger(record.name).handle(record)
+            link_cache.entries.update(result.links)
+            # Files with errors (e.g. missing notebooks) are checked again next time.
+            errors = any(record.name == "badge" for record in result.records)
+            manifest.update(file.path, None if errors else result.blob or blobs.get(file.path), inputs)
+            if stats is not None and result.stats is not None:
+                stats.merge(result.stats)
+
+    with span("save"):
+        link_cache.save()
+        manifest.save()
+
+    if stats is not None:
+        if STATS_FILE:
+            with open(STATS_FILE, "w") as fp:
+                json.dump(stats.report(), fp, indent=2)
+        if GITHUB_STEP_SUMMARY:
+            with open(GITHUB_STEP_SUMMARY, "a") as fp:
+                fp.write("### Colab Badge Action\n\n" + stats.to_markdown())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Adds/updates "Open in Colab" badges in given files, e.g. as a pre-commit hook.
+
+Exits with 1 if any file was modified or has errors (e.g. missing notebooks).
+"""
+import argparse
+import logging
+import os
+import sys
+from typing import List, Optional
+
+from lib import (
+    Badge,
+    File,
+    Patterns,
+    get_default_branch,
+    get_origin_repo,
+    has_badge_markers,
+    link_cache,
+    process_files,
+    setup_mirrors,
+    setup_scheduler,
+)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Adds/updates "Open in Colab" badges in notebooks and markdown files.')
+    parser.add_argument("files", nargs="*", help="notebooks and markdown files (other files are skipped)")
+    parser.add_argument("--repo", help="repo that badges target, owner/repo (default: from origin remote)")
+    parser.add_argument("--branch", help="branch that badges target (default: default branch of origin remote)")
+    parser.add_argument("--no-update", action="store_true", help="do not update badges inserted already")
+    parser.add_argument("--link-cache", default="", help="file to cache results of remote notebooks checks in")
+    parser.add_argument("--remote-timeout", type=float, default=10, help="timeout of checks of remote notebooks, s")
+    parser.add_argument("--remote-host", default="github.com", help="host to check remote notebooks against")
+    parser.add_argument(
+        "--remote-api-host", default="api.github.com", help="GitHub API host to list remote repos with (empty: off)"
+    )
+    parser.add_argument(
+        "--token", default=os.environ.get("GITHUB_TOKEN", ""), help="GitHub API token (default: GITHUB_TOKEN)"
+    )
+    parser.add_argument(
+        "--remote-mirror",
+        action="append",
+        default=[],
+        help="local mirror of remote repos, owner/repo=path (check remote notebooks with git), can be repeated",
+    )
+    parser.add_argument("--verbose", action="store_true", help="print processed files")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    logger_action = logging.getLogger("action")
+    logger_badge = logging.getLogger("badge")
+    for logger, fmt in ((logger_action, "%(message)s"), (logger_badge, "%(file)s:%(line)s: %(message)s")):
+        if logger.handlers:
+            continue
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(fmt=fmt))
+        logger.addHandler(handler)
+    if args.verbose:
+        logger_action.setLevel(logging.INFO)
+
+    # Skip files without badge tags and tracked badges (git is not needed then).
+    paths = [path for path in args.files if path.endswith((".ipynb", ".md")) and has_badge_markers(path)]
+    if not paths:
+        return 0
+
+    repo = args.repo or get_origin_repo()
+    branch = args.branch or get_default_branch()
+    if not repo or not branch:
+        logger_action.error("Cannot get repo or branch (no origin remote?), use --repo and --branch")
+        return 2
+
+    link_cache.path = args.link_cache
+    link_cache.load()
+    setup_scheduler(
+        concurrency=8,
+        timeout=args.remote_timeout,
+        budget=60,
+        retries=1,
+        host=args.remote_host,
+        api_host=args.remote_api_host,
+        token=args.token,
+    )
+    setup_mirrors(args.remote_mirror)
+
+    track = not args.no_update
+    files = [
+        File(path=path, type="notebook" if path.endswith(".ipynb") else "md", track=track, branch=branch, repo=repo)
+        for path in paths
+    ]
+    failed = False
+    for file, result in zip(files, process_files(files, Badge(), Patterns(), verbose=args.verbose, lazy=True)):
+        for record in result.records:
+            logging.getLogger(record.name).handle(record)
+        link_cache.entries.update(result.links)
+        if result.blob is not None:
+            logger_action.warning(f"{file.path}: badges added/updated")
+        failed = failed or result.blob is not None or any(record.name == "badge" for record in result.records)
+    link_cache.save()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,36 @@
-import http.client
 import json
 import os
 import re
-import urllib.parse
-from argparse import Namespace
-from glob import glob
-from logging import Logger
+import stat
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from fnmatch import fnmatchcase
+from logging import INFO, WARNING, Handler, Logger, LogRecord, getLogger
 from pathlib import Path
 from string import Template
-from subprocess import getoutput
-from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+# Modules needed only by some of the checks (remote links, git, workers, etc) are imported where they are used,
+# to keep startup fast (see cli.py).
+if TYPE_CHECKING:
+    import http.client
+    from concurrent.futures import Future, ThreadPoolExecutor
 
 # logging.basicConfig(format="::%(levelname)s file=%(file)s,line=%(line)s,title=%(title)s::%(message)s")
 
@@ -22,6 +43,16 @@ class File(NamedTuple):
     repo: str
 
 
+class Line:
+    """Line of a markdown file or cell."""
+
+    __slots__ = ("data", "num")
+
+    def __init__(self, data: str, num: Optional[int] = None) -> None:
+        self.data = data
+        self.num = num
+
+
 class Badge(NamedTuple):
     drive: Template = Template("https://colab.research.google.com/drive/$file")
     url: Template = Template("https://colab.research.google.com/github/$repo/blob/$branch/$file")
@@ -35,27 +66,156 @@ class Badge(NamedTuple):
 
 
 class Patterns(NamedTuple):
-    # Badge tag.
-    badge: re.Pattern = re.compile(r"(?P<badge>\{{2}\ *badge\ *(?P<path>.*?)\ *\}{2})")
-    # Badge that is tracked.
-    tracked: re.Pattern = re.compile(r"<!--<badge>-->(.*?)<!--</badge>-->")
+    # Tracked badge or badge tag (single pass).
+    combined: re.Pattern = re.compile(
+        r"(?P<tracked><!--<badge>-->.*?<!--</badge>-->)|(?P<badge>\{{2}\ *badge\ *(?P<path>.*?)\ *\}{2})"
+    )
     # Href for tracked badge case (using html).
     href: re.Pattern = re.compile(r"href=[\"\'](.*?)[\"\']")
-    # Compile a URL pattern, from https://github.com/django/django/blob/stable/1.3.x/django/core/validators.py#L45
-    url: re.Pattern = re.compile(
-        r"^(?:http|ftp)s?://"  # http:// or https://
-        r"(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|"  # Domain...
-        r"localhost|"  # localhost...
-        r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"  # ... or ip
-        r"(?::\d+)?"  # Optional port
-        r"(?:/?|[/?]\S+)$",
-        re.IGNORECASE,
-    )
 
 
-def read_file(path: str) -> Union[dict, Iterable[str]]:
+class LazyNotebook(NamedTuple):
+    """Jupyter notebook with only markdown cells sources decoded, everything else is kept as raw bytes."""
+
+    raw: bytes
+    # Cells stubs: {"cell_type": ...}, markdown cells have "source" (list of lines) as well.
+    cells: List[dict]
+    # Byte spans of source strings of the markdown cells, one per line or one for a string source (None for others).
+    spans: List[Optional[List[Tuple[int, int]]]]
+    # Original sources of the markdown cells (to find the modified ones).
+    sources: List[Optional[List[str]]]
+
+
+_json_ws = re.compile(rb"[ \t\n\r]*")
+_json_string = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+_json_struct = re.compile(rb'["\[\]{}]')
+_json_scalar = re.compile(rb"[^,\]}\s]+")
+
+
+def _json_expect(buf: bytes, pos: int, char: bytes) -> int:
+    """Skips whitespaces and expected char, returns next (non-whitespace) position."""
+    pos = _json_ws.match(buf, pos).end()  # type: ignore[union-attr]
+    if buf[pos:pos + 1] != char:
+        raise ValueError(f"Expecting {char!r} at {pos}")
+    return _json_ws.match(buf, pos + 1).end()  # type: ignore[union-attr]
+
+
+def _json_string_end(buf: bytes, pos: int) -> int:
+    """Returns end of JSON string at pos (bytes.find is way faster than regex on large strings, e.g. outputs)."""
+    end = pos
+    while True:
+        end = buf.find(b'"', end + 1)
+        if end < 0:
+            raise ValueError(f"Unterminated string at {pos}")
+        # Quote is escaped if preceded by odd number of backslashes.
+        start = end
+        while buf[start - 1] == 0x5C:
+            start -= 1
+        if (end - start) % 2 == 0:
+            return end + 1
+
+
+def _json_skip(buf: bytes, pos: int) -> int:
+    """Returns end of JSON value at pos, the value is not decoded."""
+    head = buf[pos:pos + 1]
+    if head == b'"':
+        return _json_string_end(buf, pos)
+    if head in (b"[", b"{"):
+        depth = 0
+        while True:
+            match = _json_struct.search(buf, pos)
+            if match is None:
+                raise ValueError(f"Unterminated value at {pos}")
+            pos = match.start()
+            char = buf[pos]
+            # Strings are skipped as a whole (brackets inside strings are ignored).
+            if char == 0x22:
+                pos = _json_string_end(buf, pos)
+                continue
+            depth += 1 if char in (0x5B, 0x7B) else -1
+            pos += 1
+            if depth == 0:
+                return pos
+    match = _json_scalar.match(buf, pos)
+    if match is None:
+        raise ValueError(f"Invalid value at {pos}")
+    return match.end()
+
+
+def _json_scan(buf: bytes, pos: int, close: bytes, handler: Callable[[int, Optional[str]], int]) -> int:
+    """Scans JSON object (close=b"}") or array (close=b"]") at pos (after the opening bracket).
+
+    Handler gets start of each value (and its key for objects) and returns the value end. Returns scan end.
+    """
+    pos = _json_ws.match(buf, pos).end()  # type: ignore[union-attr]
+    if buf[pos:pos + 1] == close:
+        return pos + 1
+    while True:
+        key = None
+        if close == b"}":
+            match = _json_string.match(buf, pos)
+            if match is None:
+                raise ValueError(f"Expecting key at {pos}")
+            key = json.loads(match.group())
+            pos = _json_expect(buf, match.end(), b":")
+        pos = _json_ws.match(buf, handler(pos, key)).end()  # type: ignore[union-attr]
+        char = buf[pos:pos + 1]
+        if char == close:
+            return pos + 1
+        pos = _json_expect(buf, pos, b",")
+
+
+def parse_nb_lazy(raw: bytes) -> LazyNotebook:
+    """Parses notebook, decoding only markdown cells sources."""
+    nb = LazyNotebook(raw=raw, cells=[], spans=[], sources=[])
+
+    def _cell(pos: int, _: Optional[str]) -> int:
+        cell: dict = {}
+        spans: List[Tuple[int, int]] = []
+
+        def _line(pos: int, _: Optional[str]) -> int:
+            if raw[pos:pos + 1] != b'"':
+                raise ValueError(f"Expecting string at {pos}")
+            end = _json_string_end(raw, pos)
+            spans.append((pos, end))
+            return end
+
+        def _member(pos: int, key: Optional[str]) -> int:
+            if key == "source":
+                # Either a list of strings or a string.
+                if raw[pos:pos + 1] == b"[":
+                    return _json_scan(raw, pos + 1, b"]", _line)
+                return _line(pos, None)
+            end = _json_skip(raw, pos)
+            if key == "cell_type":
+                cell["cell_type"] = json.loads(raw[pos:end])
+            return end
+
+        end = _json_scan(raw, _json_expect(raw, pos, b"{"), b"}", _member)
+        source = None
+        if cell.get("cell_type") == "markdown":
+            source = [json.loads(raw[start:stop]) for start, stop in spans]
+            # String source is split into lines (and joined back on save).
+            if len(source) == 1:
+                source = source[0].splitlines(keepends=True)
+            cell["source"] = [*source]
+        nb.cells.append(cell)
+        nb.spans.append(spans if source is not None else None)
+        nb.sources.append(source)
+        return end
+
+    def _root(pos: int, key: Optional[str]) -> int:
+        if key == "cells":
+            return _json_scan(raw, _json_expect(raw, pos, b"["), b"]", _cell)
+        return _json_skip(raw, pos)
+
+    _json_scan(raw, _json_expect(raw, 0, b"{"), b"}", _root)
+    return nb
+
+
+def read_file(path: str, lazy: bool = False) -> Union[dict, LazyNotebook, List[str]]:
     """File reader."""
-    return {".ipynb": read_nb, ".md": read_md}[Path(path).suffix](path)
+    return {".ipynb": read_nb_lazy if lazy else read_nb, ".md": read_md}[Path(path).suffix](path)
 
 
 def read_nb(path: str) -> dict:
@@ -65,16 +225,30 @@ def read_nb(path: str) -> dict:
     return data
 
 
-def read_md(path: str) -> Iterable[str]:
+def read_nb_lazy(path: str) -> Union[dict, LazyNotebook]:
+    """Reads jupyter notebook file lazily (only markdown cells sources are decoded)."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        return parse_nb_lazy(raw)
+    # Not a regular notebook, fallback to the json reader.
+    except (ValueError, IndexError, TypeError):
+        return json.loads(raw)
+
+
+def read_md(path: str) -> List[str]:
     """Reads markdowns file."""
     with open(path, "r") as f:
         data = f.readlines()
     return data
 
 
-def write_file(data: Union[dict, List[str]], path: str) -> None:
+def write_file(data: Union[dict, LazyNotebook, List[str]], path: str) -> None:
     """File writer."""
-    write_nb(data, path) if isinstance(data, dict) else write_md(data, path)
+    if isinstance(data, LazyNotebook):
+        write_nb_lazy(data, path)
+    else:
+        write_nb(data, path) if isinstance(data, dict) else write_md(data, path)
 
 
 def write_nb(data: dict, path: str) -> None:
@@ -83,38 +257,348 @@ def write_nb(data: dict, path: str) -> None:
         json.dump(data, f, indent=2)
 
 
+def write_nb_lazy(data: LazyNotebook, path: str) -> None:
+    """Saves modified jupyter notebook: only modified source strings are spliced into the original bytes."""
+    chunks, pos = [], 0
+    for cell, spans, source in zip(data.cells, data.spans, data.sources):
+        if spans is None or source is None or cell["source"] == source:
+            continue
+        # One span per line, or a single span for (split) string source.
+        lines = [*zip(spans, cell["source"], source)] if len(spans) == len(source) else [(spans[0], None, None)]
+        for (start, stop), line, old_line in lines:
+            if line is not None and line == old_line:
+                continue
+            new_line = "".join(cell["source"]) if line is None else line
+            chunks += [data.raw[pos:start], json.dumps(new_line, ensure_ascii=False).encode()]
+            pos = stop
+    chunks.append(data.raw[pos:])
+    raw = b"".join(chunks)
+    if raw != data.raw:
+        write_atomic(raw, path)
+
+
+def write_atomic(data: bytes, path: str) -> None:
+    """Writes file atomically (temporary file in the same directory replaces the original one)."""
+    import tempfile
+
+    path = os.fspath(path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if os.path.exists(path):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 def write_md(data: List[str], path: str) -> None:
     """Saves modified jupyter notebook."""
     with open(path, "w") as f:
         f.writelines(data)
 
 
-def get_all_nbs(root_dir: Optional[str] = None) -> List[str]:
-    """Get list of all the notebooks."""
-    return glob("**/*.ipynb", root_dir=root_dir, recursive=True)
-
-
-def get_all_mds(root_dir: Optional[str] = None) -> List[str]:
-    """Get list of all markdown files."""
-    return glob("**/*.md", root_dir=root_dir, recursive=True)
-
-
-def get_modified_nbs() -> List[str]:
-    """Get list of all the modified notebooks in a current commit."""
-    cmd = "git diff-tree --no-commit-id --name-only -r HEAD"
-    committed_files = getoutput(cmd).split("\n")
-    nbs = [nb for nb in committed_files if (nb.endswith(".ipynb") and os.path.isfile(nb))]
-    return nbs
+def split_globs(value: str) -> List[str]:
+    """Splits glob patterns input (separated by newlines or commas)."""
+    return [pattern.strip() for pattern in re.split(r"[\n,]", value) if pattern.strip()]
+
+
+def match_globs(path: str, patterns: Iterable[str]) -> bool:
+    """Checks whether path (or one of its parent directories) matches any of glob patterns.
+
+    Patterns without "/" are matched against names (e.g. "vendor", "*.md"), others against paths from the root.
+    """
+    parts = path.split("/")
+    for pattern in patterns:
+        pattern = pattern.strip("/")
+        if "/" in pattern:
+            if any(fnmatchcase("/".join(parts[:i]), pattern) for i in range(1, len(parts) + 1)):
+                return True
+        elif any(fnmatchcase(part, pattern) for part in parts):
+            return True
+    return False
+
+
+def filter_globs(paths: List[str], include: Iterable[str] = (), exclude: Iterable[str] = ()) -> List[str]:
+    """Keeps paths matching any of include patterns (if any) and none of exclude patterns."""
+    include, exclude = [*include], [*exclude]
+    return [
+        path
+        for path in paths
+        if (not include or match_globs(path, include)) and not (exclude and match_globs(path, exclude))
+    ]
+
+
+def list_git_files(root_dir: Optional[str] = None) -> Optional[List[str]]:
+    """Lists files from git index and untracked files (not ignored). Returns None if it is not a git repo."""
+    import subprocess
+
+    cmd = ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"]
+    try:
+        res = subprocess.run(cmd, cwd=root_dir, capture_output=True)
+    except OSError:
+        return None
+    if res.returncode != 0:
+        return None
+    return [path for path in os.fsdecode(res.stdout).split("\0") if path]
+
+
+def get_ref_files(ref: str, suffixes: Tuple[str, ...], root_dir: Optional[str] = None) -> Optional[List[str]]:
+    """Lists files with given suffixes from the tree of a branch (local or "origin" one), single git call.
+    Returns None if there is no such branch.
+    """
+    import subprocess
+
+    for name in (ref, f"origin/{ref}"):
+        cmd = ["git", "ls-tree", "-r", "-z", "--name-only", "--full-tree", f"{name}^{{tree}}"]
+        try:
+            res = subprocess.run(cmd, cwd=root_dir, capture_output=True)
+        except OSError:
+            return None
+        if res.returncode == 0:
+            return [path for path in os.fsdecode(res.stdout).split("\0") if path.endswith(suffixes)]
+    return None
+
+
+def git_output(args: List[str], root_dir: Optional[str] = None) -> Optional[str]:
+    """Runs git command, returns its output (stripped), None if it fails."""
+    import subprocess
+
+    try:
+        res = subprocess.run(["git", *args], cwd=root_dir, capture_output=True)
+    except OSError:
+        return None
+    return os.fsdecode(res.stdout).strip() if res.returncode == 0 else None
+
+
+def lookup_blobs(names: List[str], root_dir: Optional[str] = None) -> Optional[List[bool]]:
+    """Checks whether objects (e.g. "main:nbs/nb.ipynb") are blobs of the repository, single git call.
+    Returns None if git fails (e.g. there is no repository).
+    """
+    import subprocess
+
+    cmd = ["git", "cat-file", "--batch-check=%(objecttype)"]
+    data = os.fsencode("".join(f"{name}\n" for name in names))
+    try:
+        res = subprocess.run(cmd, cwd=root_dir, input=data, capture_output=True)
+    except OSError:
+        return None
+    if res.returncode != 0:
+        return None
+    # One line per object: its type, or "<name> missing" (ambiguous).
+    return [line == "blob" for line in os.fsdecode(res.stdout).splitlines()]
+
+
+def get_origin_repo(root_dir: Optional[str] = None) -> Optional[str]:
+    """Get repository name (owner/repo) from the url of "origin" remote (GitHub)."""
+    url = git_output(["remote", "get-url", "origin"], root_dir)
+    match = re.search(r"github\.com[:/](?P<repo>[^/]+/[^/]+?)(?:\.git)?/?$", url or "")
+    return match["repo"] if match else None
+
+
+def get_default_branch(root_dir: Optional[str] = None) -> Optional[str]:
+    """Get default branch of "origin" remote, or the current branch."""
+    ref = git_output(["symbolic-ref", "-q", "--short", "refs/remotes/origin/HEAD"], root_dir)
+    if ref:
+        return ref.split("/", 1)[-1]
+    return git_output(["symbolic-ref", "-q", "--short", "HEAD"], root_dir)
+
+
+def walk_files(root_dir: Optional[str] = None, exclude: Iterable[str] = ()) -> Iterator[str]:
+    """Walks directory tree, excluded directories are pruned (not walked)."""
+    exclude = [*exclude]
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root_dir or ".", rel_dir))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git" and not (exclude and match_globs(path, exclude)):
+                        stack.append(path)
+                else:
+                    yield path
 
 
-def get_modified_mds() -> List[str]:
-    """Get list of all the modified markdown files in a current commit."""
-    cmd = "git diff-tree --no-commit-id --name-only -r HEAD"
-    committed_files = getoutput(cmd).split("\n")
-    mds = [md for md in committed_files if (md.endswith(".md") and os.path.isfile(md))]
-    return mds
+def get_all_files(
+    suffixes: Tuple[str, ...],
+    root_dir: Optional[str] = None,
+    include: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+) -> List[str]:
+    """Get list of all the files with given suffixes (from git index, or walking the tree if it is not a git repo)."""
+    include, exclude = [*include], [*exclude]
+    files = list_git_files(root_dir)
+    if files is None:
+        files = [*walk_files(root_dir, exclude)]
+    files = [file for file in files if file.endswith(suffixes)]
+    return filter_globs(files, include, exclude)
 
 
+def get_all_nbs(root_dir: Optional[str] = None, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> List[str]:
+    """Get list of all the notebooks."""
+    return get_all_files((".ipynb",), root_dir, include, exclude)
+
+
+class NotebookIndex:
+    """In-memory index of the repository notebooks, paths are listed by the loader (if any) on first use."""
+
+    def __init__(self, paths: Iterable[str] = (), loader: Optional[Callable[[], Iterable[str]]] = None) -> None:
+        self.loader = loader
+        self._paths: Set[str] = {os.path.normpath(path) for path in paths}
+        # Notebooks grouped by file name and by directory (for suggestions), built on first use.
+        self.by_name: Dict[str, List[str]] = {}
+        self.by_dir: Dict[str, List[str]] = {}
+
+    @property
+    def paths(self) -> Set[str]:
+        if self.loader is not None:
+            loader, self.loader = self.loader, None
+            self._paths.update(os.path.normpath(path) for path in loader())
+        return self._paths
+
+    def __getstate__(self) -> dict:
+        # Loader is not passed to workers, the index is loaded instead.
+        self.paths
+        return self.__dict__
+
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, str) and os.path.normpath(path) in self.paths
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def suggest(self, path: str, n: int = 3) -> List[str]:
+        """Returns the closest notebooks: moved ones (same name) or similar ones from the same directory."""
+        if not self.by_name and self.paths:
+            for nb in sorted(self.paths):
+                dir_name, name = os.path.split(nb)
+                self.by_name.setdefault(name, []).append(nb)
+                self.by_dir.setdefault(dir_name, []).append(nb)
+        dir_name, name = os.path.split(os.path.normpath(path))
+        if name in self.by_name:
+            return self.by_name[name][:n]
+        # Names are compared without the extension (shared by all the notebooks).
+        stems = {os.path.splitext(os.path.basename(nb))[0]: nb for nb in self.by_dir.get(dir_name, [])}
+        from difflib import get_close_matches
+
+        return [stems[stem] for stem in get_close_matches(os.path.splitext(name)[0], stems, n=n)]
+
+
+def get_all_mds(root_dir: Optional[str] = None, include: Iterable[str] = (), exclude: Iterable[str] = ()) -> List[str]:
+    """Get list of all markdown files."""
+    return get_all_files((".md",), root_dir, include, exclude)
+
+
+def get_push_range(event_path: Optional[str]) -> Optional[str]:
+    """Get range of commits (before..after) from a push event payload."""
+    if not event_path:
+        return None
+    try:
+        with open(event_path, "r") as f:
+            event = json.load(f)
+        before, after = event["before"], event["after"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    # New branch (no previous commit).
+    if not before or not after or set(before) == {"0"}:
+        return None
+    return f"{before}..{after}"
+
+
+def get_changed_files(commit_range: Optional[str] = None, root_dir: Optional[str] = None) -> List[str]:
+    """Get list of added/modified/renamed files in a range of commits (or in the current commit), single git call.
+
+    Falls back to the current commit if the range is not available (e.g. shallow clone), with a warning.
+    """
+    import subprocess
+
+    opts = ["--name-only", "-z", "-M", "--diff-filter=ACMR"]
+    cmds = [["git", "diff-tree", "--no-commit-id", "-r", "--root", *opts, "HEAD"]]
+    if commit_range:
+        cmds.insert(0, ["git", "diff", *opts, commit_range, "--"])
+    for cmd in cmds:
+        try:
+            res = subprocess.run(cmd, cwd=root_dir, capture_output=True)
+        except OSError as e:
+            getLogger("action").warning(f"Cannot get changed files, git failed: {e}")
+            return []
+        if res.returncode == 0:
+            return [path for path in os.fsdecode(res.stdout).split("\0") if path]
+        if cmd is not cmds[-1]:
+            getLogger("action").warning(
+                f"Cannot resolve commit range {commit_range} (shallow clone?), checking the current commit only"
+            )
+    return []
+
+
+def get_modified_files(commit_range: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """Get lists of modified notebooks and markdown files in a range of commits (or in the current commit)."""
+    files = [file for file in get_changed_files(commit_range) if os.path.isfile(file)]
+    return [file for file in files if file.endswith(".ipynb")], [file for file in files if file.endswith(".md")]
+
+
+# Badge tag or tracked badge, for fast (raw) checks of files.
+BADGE_MARKERS = r"\{\{ *badge|<!--<badge>-->"
+_badge_markers = re.compile(BADGE_MARKERS.encode())
+
+
+def has_badge_markers(path: str) -> bool:
+    """Checks whether file contains badge tags or tracked badges (raw scan of memory mapped file)."""
+    import mmap
+
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _badge_markers.search(mm) is not None  # type: ignore[call-overload]
+    # Empty (or unreadable) file.
+    except (OSError, ValueError):
+        return False
+
+
+def grep_badge_files(root_dir: Optional[str] = None, paths: Optional[List[str]] = None) -> Optional[Set[str]]:
+    """Lists notebooks and markdown files (only given paths, if any) containing badge tags or tracked badges with
+    git grep. Paths are passed in batches (literal pathspecs, command line length is limited).
+
+    Returns None if git grep is not available (not a git repo, no git, etc).
+    """
+    import subprocess
+
+    cmd = ["git", "grep", "-l", "-z", "--untracked", "-E", BADGE_MARKERS, "--"]
+    if paths is None:
+        batches, env = [["*.ipynb", "*.md"]], None
+    else:
+        batches = [paths[i:i + 1000] for i in range(0, len(paths), 1000)]
+        env = {**os.environ, "GIT_LITERAL_PATHSPECS": "1"}
+    found: Set[str] = set()
+    for batch in batches:
+        try:
+            res = subprocess.run([*cmd, *batch], cwd=root_dir, env=env, capture_output=True)
+        except OSError:
+            return None
+        # Exit code 1 means nothing found.
+        if res.returncode not in (0, 1):
+            return None
+        found.update(path for path in os.fsdecode(res.stdout).split("\0") if path)
+    return found
+
+
+def filter_badge_files(paths: List[str], root_dir: Optional[str] = None) -> List[str]:
+    """Keeps only files containing badge tags or tracked badges (so the rest is never parsed)."""
+    if not paths:
+        return paths
+    found = grep_badge_files(root_dir, paths)
+    if found is None:
+        return [path for path in paths if has_badge_markers(os.path.join(root_dir or "", path))]
+    return [path for path in paths if os.path.normpath(path) in found]
+
+
+@lru_cache(maxsize=None)
 def append_ext_to_str(path: str) -> str:
     """Adds jupyter notebook extension if necessary."""
     p = Path(path)
@@ -125,6 +609,8 @@ def append_ext_to_str(path: str) -> str:
 
 def append_ext_to_url(url: str) -> str:
     """Adds jupyter notebook to url extension if necessary."""
+    import urllib.parse
+
     path = urllib.parse.urlsplit(url).path
     new_path = append_ext_to_str(path)
     if new_path != path:
@@ -132,98 +618,932 @@ def append_ext_to_url(url: str) -> str:
     return url
 
 
+class ConnectionPool:
+    """Pool of persistent (keep-alive) HTTPS connections, grouped by host ("host[:port]", or "http://host[:port]")."""
+
+    def __init__(self, timeout: Optional[float] = None) -> None:
+        self.timeout = timeout
+        self.idle: Dict[str, List["http.client.HTTPConnection"]] = {}
+        self.lock = threading.Lock()
+
+    def connect(self, host: str) -> "http.client.HTTPConnection":
+        import http.client
+
+        scheme, _, netloc = host.rpartition("://")
+        if scheme == "http":
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+
+    def acquire(self, host: str) -> Tuple["http.client.HTTPConnection", bool]:
+        """Returns idle connection to the host (or a new one) and whether it was reused."""
+        with self.lock:
+            idle = self.idle.get(host)
+            if idle:
+                return idle.pop(), True
+        return self.connect(host), False
+
+    def release(self, host: str, connection: "http.client.HTTPConnection") -> None:
+        """Puts connection back to the pool, closed connections are dropped."""
+        if connection.sock is None:
+            return
+        with self.lock:
+            self.idle.setdefault(host, []).append(connection)
+
+    def request(
+        self, method: str, host: str, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> "http.client.HTTPResponse":
+        """Sends request over a pooled connection. Response is fully read, so the connection can be reused."""
+        return self.send(method, host, url, headers)[0]
+
+    def send(
+        self, method: str, host: str, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Tuple["http.client.HTTPResponse", bytes]:
+        """Sends request over a pooled connection, returns response and its body."""
+        import http.client
+
+        connection, reused = self.acquire(host)
+        try:
+            connection.request(method, url, None, headers or {})
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            # Kept-alive connection might be closed by the server in the meantime, retry once with a new one.
+            if not reused:
+                raise
+            connection = self.connect(host)
+            connection.request(method, url, None, headers or {})
+            response = connection.getresponse()
+        body = response.read()
+        self.release(host, connection)
+        return response, body
+
+    def close(self) -> None:
+        """Closes all idle connections."""
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+class CacheEntry(NamedTuple):
+    time: float
+    status: int
+    reason: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class LinkCache:
+    """Persistent (on-disk) cache of link checks results."""
+
+    version = 1
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 86400, negative_ttl: float = 3600) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries: Dict[str, CacheEntry] = {}
+        # Entries added/refreshed since the last call of pop_updates.
+        self.updates: Dict[str, CacheEntry] = {}
+
+    def load(self) -> None:
+        """Loads cache file, missing or broken file means an empty cache."""
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.entries = {link: CacheEntry(**entry) for link, entry in data["links"].items()}
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            self.entries = {}
+
+    def save(self) -> None:
+        """Saves cache file (atomically)."""
+        if not self.path:
+            return
+        data = {"version": self.version, "links": {link: entry._asdict() for link, entry in self.entries.items()}}
+        write_atomic(json.dumps(data).encode(), self.path)
+
+    def get(self, link: str) -> Optional[CacheEntry]:
+        return self.entries.get(link) if self.path else None
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """Checks entry age, negative results (bad links) expire sooner."""
+        ttl = self.ttl if entry.status < 400 else self.negative_ttl
+        return (time.time() - entry.time) < ttl
+
+    def put(self, link: str, entry: CacheEntry) -> None:
+        if not self.path:
+            return
+        self.entries[link] = entry
+        self.updates[link] = entry
+
+    def pop_updates(self) -> Dict[str, CacheEntry]:
+        updates, self.updates = self.updates, {}
+        return updates
+
+
+class RemoteScheduler:
+    """Checks links concurrently (bounded), with timeouts, overall time budget, retries and rate limits handling.
+
+    Repo trees are listed with GitHub API (api_host, empty to disable; with the token, if any), to check many links of
+    a repo at once.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        timeout: float = 10,
+        budget: float = 600,
+        retries: int = 3,
+        backoff: float = 1,
+        host: str = "github.com",
+        api_host: str = "api.github.com",
+        token: str = "",
+    ) -> None:
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.deadline = time.time() + budget
+        self.retries = retries
+        self.backoff = backoff
+        self.host = host
+        self.api_host = api_host
+        self.token = token
+        self.pool = ConnectionPool(timeout=timeout)
+        # Threads are started on the first request.
+        self.executor: Optional["ThreadPoolExecutor"] = None
+        self.futures: Dict[str, "Future"] = {}
+        # Listings of repo trees: (owner, repo, ref) -> paths of files, listed once per run.
+        self.trees: Dict[Tuple[str, str, str], "Future"] = {}
+        # Number of links prefetched per repo ref (owner, repo, ref).
+        self.refs: Dict[Tuple[str, str, str], int] = {}
+        self.lock = threading.Lock()
+        # Requests are paused until this time (rate limit exceeded).
+        self.paused_until = 0.0
+
+    def __reduce__(self) -> Tuple[type, tuple]:
+        # Worker processes get their own scheduler with the same settings (and the same deadline).
+        budget = self.deadline - time.time()
+        args = (
+            self.concurrency, self.timeout, budget, self.retries, self.backoff, self.host, self.api_host, self.token
+        )
+        return RemoteScheduler, args
+
+    def schedule(self, futures: Dict, key: Union[str, tuple], fn: Callable) -> "Future":
+        """Runs fn(key) in the threads, only once per key (futures are kept in the futures dict)."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with self.lock:
+            future = futures.get(key)
+            if future is None:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="remote")
+                future = futures[key] = self.executor.submit(fn, key)
+        return future
+
+    def shutdown(self) -> None:
+        """Waits for the scheduled requests and stops the threads (restarted on the next request), e.g. to fork."""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def submit(self, nb: str) -> "Future":
+        """Schedules link check (only once per link)."""
+        return self.schedule(self.futures, nb, self.fetch)
+
+    def prefetch(self, link: str, key: Optional[Tuple[str, str, str]] = None) -> None:
+        """Starts link check early (e.g. during the scan). If tree listings are enabled, only the first link of a repo
+        ref (key) is checked, the listing of the ref tree is started for the next ones (see GitHubResolver.check_trees).
+        """
+        if key is not None and self.api_host:
+            with self.lock:
+                n = self.refs[key] = self.refs.get(key, 0) + 1
+            if n > 1:
+                self.submit_tree(*key)
+                return
+        self.submit(link)
+
+    def submit_tree(self, owner: str, repo: str, ref: str) -> "Future":
+        """Schedules listing of the repo tree at the ref (only once per ref)."""
+        return self.schedule(self.trees, (owner, repo, ref), self.fetch_tree)
+
+    def wait(self, future: "Future", default: Any) -> Any:
+        """Waits for future result within the time budget, returns default if the time is over."""
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+
+        try:
+            return future.result(timeout=max(0.0, self.deadline - time.time()))
+        except FutureTimeoutError:
+            return default
+
+    def check(self, nb: str) -> Optional[Tuple[int, str]]:
+        """Waits for link check result, within the time budget."""
+        result = self.wait(self.submit(nb), False)
+        return self.unverified(nb, (408, "Request Timeout")) if result is False else result
+
+    @staticmethod
+    def is_transient(response: Optional["http.client.HTTPResponse"], status: int) -> bool:
+        """Whether the failure is (probably) temporary: no response, timeouts, rate limits or server errors."""
+        if response is None or status in (408, 429) or status >= 500:
+            return True
+        rate_limited = response.getheader("X-RateLimit-Remaining") == "0" or bool(response.getheader("Retry-After"))
+        return status == 403 and rate_limited
+
+    @staticmethod
+    def unverified(nb: str, status: Tuple[int, str]) -> None:
+        """Transient failures do not block badges: the link is not verified, a warning is logged."""
+        count("remote_unverified")
+        getLogger("action").warning(f"{nb}: Link is not verified ({status[0]} {status[1]}), the badge is kept anyway")
+        return None
+
+    def tree(self, owner: str, repo: str, ref: str) -> Optional[Set[str]]:
+        """Waits for listing of the repo tree, within the time budget."""
+        return self.wait(self.submit_tree(owner, repo, ref), None)
+
+    def retry_delay(self, response: "http.client.HTTPResponse", attempt: int) -> Optional[float]:
+        """Returns delay before the next attempt, None if the response is final."""
+        retry_after = response.getheader("Retry-After")
+        remaining = response.getheader("X-RateLimit-Remaining")
+        reset = response.getheader("X-RateLimit-Reset")
+        if remaining == "0" and reset and reset.isdigit():
+            # No requests left, pause all of them until the reset.
+            self.paused_until = max(self.paused_until, float(reset))
+        status = response.status
+        if not self.is_transient(response, status):
+            return None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        if remaining == "0" and reset and reset.isdigit():
+            return max(0.0, float(reset) - time.time())
+        return self.backoff * 2**attempt
+
+    def request(
+        self, nb: str, headers: Dict[str, str]
+    ) -> Tuple[Optional["http.client.HTTPResponse"], Tuple[int, str]]:
+        """Sends HEAD request, retrying with backoff. Returns final response (if any) and its status."""
+        import http.client
+
+        response, status = None, (408, "Request Timeout")
+        for attempt in range(self.retries + 1):
+            pause = self.paused_until - time.time()
+            if pause > 0:
+                if time.time() + pause > self.deadline:
+                    break
+                time.sleep(pause)
+            count("remote_requests")
+            try:
+                response = self.pool.request("HEAD", self.host, nb, headers)
+            except (OSError, http.client.HTTPException) as e:
+                response, status = None, (408, "Request Timeout") if isinstance(e, TimeoutError) else (0, "Error")
+                delay = self.backoff * 2**attempt
+            else:
+                status = (response.status, response.reason)
+                retry_delay = self.retry_delay(response, attempt)
+                if retry_delay is None:
+                    break
+                delay = retry_delay
+            if attempt == self.retries or time.time() + delay > self.deadline:
+                break
+            time.sleep(delay)
+        return response, status
+
+    def fetch_tree(self, key: Tuple[str, str, str]) -> Optional[Set[str]]:
+        """Lists paths of files of the repo tree at the ref with a single request (recursive tree).
+        Returns None if the listing is not available (API disabled, errors, rate limits, truncated listing).
+        """
+        import http.client
+        from urllib.parse import quote
+
+        owner, repo, ref = key
+        if not self.api_host or time.time() > self.deadline:
+            return None
+        count("tree_requests")
+        url = f"/repos/{quote(owner)}/{quote(repo)}/git/trees/{quote(ref, safe='')}?recursive=1"
+        headers = {"Accept": "application/vnd.github+json", "User-Agent": "colab-badge-action"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            response, body = self.pool.send("GET", self.api_host, url, headers)
+        except (OSError, http.client.HTTPException):
+            return None
+        if response.status != 200:
+            return None
+        try:
+            data = json.loads(body)
+            if data.get("truncated"):
+                return None
+            return {item["path"] for item in data["tree"] if item.get("type") == "blob"}
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+    def fetch(self, nb: str) -> Optional[Tuple[int, str]]:
+        """Checks link, fresh results are taken from the link cache."""
+        entry = link_cache.get(nb)
+        count("remote_checks")
+        if entry is None or not link_cache.is_fresh(entry):
+            count("cache_misses")
+            if time.time() > self.deadline:
+                return self.unverified(nb, (408, "Request Timeout"))
+            # Revalidate stale entry with a conditional request.
+            headers = {}
+            if entry is not None and entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry is not None and entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+            response, (status, reason) = self.request(nb, headers)
+            # Not modified, just refresh the timestamp.
+            if status == 304 and entry is not None:
+                count("cache_revalidated")
+                entry = entry._replace(time=time.time())
+            # Do not cache errors which are (probably) temporary, nor block the badge.
+            elif response is None or self.is_transient(response, status):
+                return self.unverified(nb, (status, reason))
+            elif status == 403:
+                return (status, reason)
+            else:
+                entry = CacheEntry(
+                    time=time.time(),
+                    status=status,
+                    reason=reason,
+                    etag=response.getheader("ETag"),
+                    last_modified=response.getheader("Last-Modified"),
+                )
+            link_cache.put(nb, entry)
+        else:
+            count("cache_hits")
+
+        bad = None
+        status, reason = entry.status, entry.reason
+        if not (status < 400):
+            bad = (status, reason)
+
+        return bad
+
+
+class Stats:
+    """Counters and timings (in seconds) of the run, collected only if enabled (see setup_stats)."""
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, int] = {}
+        self.timings: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def pop(self) -> dict:
+        """Returns collected stats and starts from scratch."""
+        with self.lock:
+            report = {"counters": self.counters, "timings": self.timings}
+            self.counters, self.timings = {}, {}
+        return report
+
+    def merge(self, report: dict) -> None:
+        """Adds stats collected elsewhere (e.g. in a worker process)."""
+        for name, value in report["counters"].items():
+            self.add(name, value)
+        with self.lock:
+            for name, seconds in report["timings"].items():
+                self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"counters": dict(self.counters), "timings": {k: round(v, 6) for k, v in self.timings.items()}}
+
+    def to_markdown(self) -> str:
+        """Run summary, as markdown tables."""
+        report = self.report()
+        rows = ["| Stage | Time, s |", "|:------|--------:|"]
+        rows += [f"| {name} | {seconds:.3f} |" for name, seconds in report["timings"].items()]
+        rows += ["", "| Counter | Value |", "|:--------|------:|"]
+        rows += [f"| {name} | {value} |" for name, value in report["counters"].items()]
+        return "\n".join(rows) + "\n"
+
+
+link_cache = LinkCache()
+scheduler = RemoteScheduler()
+# Stats of the run, None if disabled.
+stats: Optional[Stats] = None
+# Peak memory (traced) of processing of each file, None if not profiling.
+memory_peaks: Optional[Dict[str, int]] = None
+# Results of link checks made during the run (link -> error or None).
+checked_links: Dict[str, Optional[Tuple[int, str]]] = {}
+# Notebooks of the repository (local badges are checked against it), None to check the file system.
+nb_index: Optional[NotebookIndex] = None
+
+
+# Local mirrors (bare clones) of remote repos: (owner/repo glob, path), remote links are checked against them.
+mirrors: List[Tuple[str, str]] = []
+
+
+def setup_mirrors(entries: Iterable[str]) -> List[Tuple[str, str]]:
+    """Sets local mirrors of remote repos, entries: owner/repo=path (owner/repo can be a glob, path can contain
+    {owner} and {repo}, e.g. "*=/mirrors/{owner}/{repo}.git").
+    """
+    global mirrors
+    mirrors = []
+    for entry in entries:
+        pattern, _, path = (part.strip() for part in entry.partition("="))
+        if not pattern or not path:
+            raise ValueError(f"{entry} is a wrong value. Expecting owner/repo=path")
+        mirrors.append((pattern, path))
+    return mirrors
+
+
+def get_mirror(owner: str, repo: str) -> Optional[str]:
+    """Returns path to the local mirror of a remote repo, the first matching one."""
+    for pattern, path in mirrors:
+        if fnmatchcase(f"{owner}/{repo}", pattern):
+            return path.format(owner=owner, repo=repo)
+    return None
+
+
+def check_mirrors(links: Iterable[str]) -> None:
+    """Checks links to notebooks of remote repos with local mirrors, with git object lookups (one git call per
+    mirror) instead of requests. Results are stored as checked links, links of other repos are skipped.
+    """
+    from urllib.parse import unquote
+
+    groups: Dict[str, Dict[str, List[str]]] = {}
+    for link in links:
+        # Link: /<owner>/<repo>/blob/<ref>/<path>, ref can contain slashes, so each split is looked up.
+        parts = [unquote(part) for part in link.split("/")]
+        if link in checked_links or len(parts) < 6 or parts[0] or parts[3] != "blob":
+            continue
+        mirror = get_mirror(parts[1], parts[2])
+        if mirror is None:
+            continue
+        names = []
+        for i in range(5, len(parts)):
+            ref, path = "/".join(parts[4:i]), "/".join(parts[i:])
+            names += [f"{ref}:{path}", f"origin/{ref}:{path}"]
+        groups.setdefault(mirror, {})[link] = names
+    for mirror, group in groups.items():
+        names = [name for link_names in group.values() for name in link_names]
+        found = lookup_blobs(names, mirror)
+        if found is None or len(found) != len(names):
+            continue
+        blobs = {name for name, blob in zip(names, found) if blob}
+        for link, link_names in group.items():
+            checked_links[link] = None if blobs.intersection(link_names) else (404, "Not Found")
+        count("mirror_checks", len(group))
+
+
+def setup_nb_index(paths: Iterable[str] = (), loader: Optional[Callable[[], Iterable[str]]] = None) -> NotebookIndex:
+    """Sets the index of the repository notebooks, used to check local badges (the loader runs on first check)."""
+    global nb_index
+    nb_index = NotebookIndex(paths, loader)
+    return nb_index
+
+
+def setup_stats(enabled: bool) -> Optional[Stats]:
+    """Enables (or disables) collection of stats."""
+    global stats
+    stats = Stats() if enabled else None
+    return stats
+
+
+def span(name: str) -> ContextManager:
+    """Times a stage of the run (if stats are enabled)."""
+    return stats.span(name) if stats is not None else nullcontext()
+
+
+def count(name: str, value: int = 1) -> None:
+    """Increments a counter (if stats are enabled)."""
+    if stats is not None:
+        stats.add(name, value)
+
+
+@contextmanager
+def local_stats() -> Iterator[Optional[Stats]]:
+    """Collects stats of the block into a new instance (yielded), instead of the global one (if stats are enabled)."""
+    global stats
+    if stats is None:
+        yield None
+        return
+    outer, stats = stats, Stats()
+    try:
+        yield stats
+    finally:
+        stats = outer
+
+
+@contextmanager
+def profile_run(directory: str, top: int = 30) -> Iterator[None]:
+    """Profiles CPU time (cProfile) and memory allocations (tracemalloc) of the block, results are written to the
+    directory: cpu.pstats, cpu.txt (top functions), memory.txt (peak, peaks per file and top allocations).
+    Does nothing if it is empty.
+    """
+    global memory_peaks
+    if not directory:
+        yield
+        return
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    os.makedirs(directory, exist_ok=True)
+    memory_peaks = {}
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(os.path.join(directory, "cpu.pstats"))
+        with open(os.path.join(directory, "cpu.txt"), "w") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(top)
+        peaks, memory_peaks = sorted(memory_peaks.items(), key=lambda item: -item[1]), None
+        with open(os.path.join(directory, "memory.txt"), "w") as f:
+            f.write(f"Peak: {peak / 2**20:.1f} MiB, at exit: {current / 2**20:.1f} MiB\n\nPeaks per file:\n")
+            f.writelines(f"{path}: {size / 2**20:.1f} MiB\n" for path, size in peaks[:top])
+            f.write("\nTop allocations at exit:\n")
+            f.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:top])
+
+
+def setup_scheduler(
+    concurrency: int,
+    timeout: float,
+    budget: float,
+    retries: int,
+    host: str = "github.com",
+    api_host: str = "api.github.com",
+    token: str = "",
+) -> None:
+    """Replaces remote links scheduler with a new one."""
+    global scheduler
+    scheduler = RemoteScheduler(
+        concurrency=concurrency,
+        timeout=timeout,
+        budget=budget,
+        retries=retries,
+        host=host,
+        api_host=api_host,
+        token=token,
+    )
+
+
 def check_nb_link(nb: str) -> Optional[Tuple[int, str]]:
-    """Link checker."""
-    bad = None
-    connection = http.client.HTTPSConnection("github.com")
-    connection.request("HEAD", nb)
-    response = connection.getresponse()
-    connection.close()
+    """Link checker. Each distinct link is checked only once (see RemoteScheduler)."""
+    if nb in checked_links:
+        return checked_links[nb]
+    if mirrors:
+        check_mirrors([nb])
+        if nb in checked_links:
+            return checked_links[nb]
 
-    status, reason = response.status, response.reason
-    if not (status < 400):
-        bad = (status, reason)
+    bad = scheduler.check(nb)
 
+    checked_links[nb] = bad
     return bad
 
 
-def prepare_path_drive(nb_path: str, badge: Badge) -> Optional[str]:
-    success = None
-    nb_path_url = badge.drive.safe_substitute(file=nb_path.lstrip("//drive/"))
-    if nb_path_url:
-        success = nb_path_url
-    return success
+class Location(NamedTuple):
+    """Badge tag or tracked badge found by the scan: cell (index, None for markdown files), line (index) and
+    target of the tag (empty for self badges and tracked badges).
+    """
 
+    cell: Optional[int]
+    line: int
+    target: str
 
-def prepare_path_remote(
-    match: re.Match, nb_path: str, line: Namespace, file: File, badge: Badge, logger: Logger
-) -> Optional[str]:
-    success = None
+
+def find_locations(lines: Iterable[str], patterns: Patterns, cell: Optional[int] = None) -> Iterator[Location]:
+    """Finds badge tags and tracked badges of markdown lines (of a file or a cell)."""
+    i = -1
+    for i, line in enumerate(lines):
+        if "{{" not in line and "<!--<badge>-->" not in line:
+            continue
+        for match in patterns.combined.finditer(line):
+            yield Location(cell, i, match["path"] or "")
+    if stats is not None:
+        stats.add("lines_scanned", i + 1)
+
+
+def find_lines(text: List[str], patterns: Patterns) -> List[int]:
+    """Returns indices of lines with badge tags or tracked badges."""
+    return [*dict.fromkeys(location.line for location in find_locations(text, patterns))]
+
+
+def locate(data: Union[dict, LazyNotebook, List[str]], patterns: Patterns) -> List[Location]:
+    """Finds badge tags and tracked badges of a file read (markdown lines or notebook markdown cells only)."""
+    if isinstance(data, list):
+        return [*find_locations(data, patterns)]
+    cells = data.cells if isinstance(data, LazyNotebook) else data["cells"]
+    return [
+        location
+        for i, cell in enumerate(cells)
+        if cell["cell_type"] == "markdown"
+        for location in find_locations(cell["source"], patterns, i)
+    ]
+
+
+def scan_file(
+    path: str, patterns: Patterns, lazy: bool = True, parsed: Optional[Dict[str, Union[dict, LazyNotebook]]] = None
+) -> List[Location]:
+    """Finds badge tags and tracked badges of a file: lines of markdown files (read line by line) or sources of
+    markdown cells of notebooks (code cells and outputs are skipped). Notebooks with badges are kept in parsed (if
+    given), so they are not read again when badges are applied.
+    """
+    try:
+        if not path.endswith(".ipynb"):
+            with open(path, "r") as f:
+                return [*find_locations(f, patterns)]
+        data = read_file(path, lazy=lazy)
+        locations = locate(data, patterns)
+        if locations and parsed is not None and not isinstance(data, list):
+            parsed[path] = data
+        return locations
+    # Unreadable files are reported when badges are applied.
+    except (OSError, ValueError, IndexError, TypeError, KeyError):
+        return []
+
+
+class Resolution(NamedTuple):
+    """Resolved badge target: notebook url, or error (title and message) if the target is wrong."""
+
+    url: Optional[str]
+    title: str = ""
+    message: str = ""
+
+
+def resolve_drive(nb_path: str, badge: Badge) -> Resolution:
+    return Resolution(badge.drive.safe_substitute(file=nb_path.lstrip("//drive/")) or None)
+
+
+def resolve_remote(nb_path: str, badge: Badge) -> Resolution:
     nb_path_ext = append_ext_to_url(nb_path)
     res = check_nb_link(nb_path_ext)
     # Notebook exists (link is OK).
     if res is None:
-        nb_path_url = badge.url2.safe_substitute(file=nb_path_ext)
-        success = nb_path_url
+        return Resolution(badge.url2.safe_substitute(file=nb_path_ext))
     # Notebook: bad link (on github).
-    else:
-        line_num_str, status, reason = map(str, (line.num or "", res[0], res[1]))
-        title = ":".join((file.path, line_num_str, " " + f"{status} {reason}"))
-        logger.error(
-            f"Specified file {nb_path} {reason}.",
-            extra={"file": file.path, "line": line_num_str, "title": title},
-        )
-    return success
+    status, reason = map(str, res)
+    return Resolution(None, f"{status} {reason}", f"Specified file {nb_path} {reason}.")
 
 
-def prepare_path_remote_full(
-    match: re.Match, nb_path: str, line: Namespace, file: File, badge: Badge, logger: Logger
-) -> Optional[str]:
-    success = None
-    nb_path_ext = append_ext_to_url(nb_path)
-    # Check hostname.
-    # TODO: gists?
-    nb_path_parse_res = urllib.parse.urlparse(nb_path_ext)
+def resolve_remote_full(nb_path: str, badge: Badge) -> Resolution:
+    from urllib.parse import urlparse
+
+    nb_path_parse_res = urlparse(append_ext_to_url(nb_path))
     # Only github is allowed.
+    # Other hosts (e.g. gists) can be added with register_resolver.
     if nb_path_parse_res.hostname == "github.com":
-        # Get notebook path.
-        nb_path_url = prepare_path_remote(match, nb_path_parse_res.path, line, file, badge, logger)
-        if nb_path_url is not None:
-            success = nb_path_url
+        return resolve_remote(nb_path_parse_res.path, badge)
     # Host is not supported.
-    else:
-        line_num_str = str(line.num or "")
-        title = ":".join((file.path, line_num_str, " " + "Wrong hostname."))
-        logger.error(
-            "Currently only notebooks hosted on GitHub are supported.",
-            extra={"file": file.path, "line": line_num_str, "title": title},
-        )
-    return success
+    return Resolution(None, "Wrong hostname.", "Currently only notebooks hosted on GitHub are supported.")
 
 
-def prepare_path_local(
-    match: re.Match, nb_path: str, line: Namespace, file: File, badge: Badge, logger: Logger
-) -> Optional[str]:
-    success = None
+def resolve_local(nb_path: str, file: File, badge: Badge) -> Resolution:
     nb_path_ext = append_ext_to_str(nb_path)
-    # Check file existence.
-    _path = Path(nb_path_ext)
+    # Check file existence (in the index if any).
+    if nb_index is not None:
+        exists = nb_path_ext in nb_index
+    else:
+        _path = Path(nb_path_ext)
+        exists = _path.exists() and _path.is_file()
     # File is OK.
-    if _path.exists() and _path.is_file():
-        nb_path_url = badge.url.safe_substitute(repo=file.repo, branch=file.branch, file=nb_path_ext)
-        success = nb_path_url
+    if exists:
+        return Resolution(badge.url.safe_substitute(repo=file.repo, branch=file.branch, file=nb_path_ext))
     # No such file.
-    else:
+    message = f"Specified file {nb_path} doesn't exist in current repository."
+    suggestions = nb_index.suggest(nb_path_ext) if nb_index is not None else []
+    if suggestions:
+        message += f" Did you mean {', '.join(suggestions)}?"
+    return Resolution(None, "File doesn't exist.", message)
+
+
+def is_url(target: str) -> bool:
+    """Checks if a badge target is a full url (by the scheme)."""
+    return target[:8].lower().startswith(("http://", "https://", "ftp://", "ftps://"))
+
+
+class Resolver:
+    """Resolves badge targets of a kind (e.g. local notebooks).
+
+    Subclasses implement a cheap match of the targets and resolve, or resolve_many to resolve a batch of targets at
+    once (e.g. with a single request per remote repo).
+    """
+
+    def match(self, target: str) -> bool:
+        raise NotImplementedError
+
+    def resolve(self, target: str, file: File, badge: Badge) -> Resolution:
+        raise NotImplementedError
+
+    def resolve_many(self, targets: List[str], file: File, badge: Badge) -> Dict[str, Resolution]:
+        return {target: self.resolve(target, file, badge) for target in targets}
+
+    def prefetch(self, target: str) -> None:
+        """Starts resolving a target found by the scan in background (if it is slow, e.g. requests)."""
+
+
+class DriveResolver(Resolver):
+    """Notebooks from the google drive: //drive/<id>."""
+
+    def match(self, target: str) -> bool:
+        return target.startswith("//drive/")
+
+    def resolve(self, target: str, file: File, badge: Badge) -> Resolution:
+        return resolve_drive(target, badge)
+
+
+class GitHubResolver(Resolver):
+    """Notebooks from other repos: /<owner>/<repo>/blob/<branch>/<path> or full urls.
+
+    Urls of other hosts are rejected, hosts like gists can be supported with resolvers registered before this one.
+    """
+
+    def match(self, target: str) -> bool:
+        return target.startswith("/") or is_url(target)
+
+    def link(self, target: str) -> Optional[str]:
+        """Returns link to check (path on GitHub), None for other hosts."""
+        if not is_url(target):
+            return append_ext_to_url(target)
+        from urllib.parse import urlsplit
+
+        split_res = urlsplit(append_ext_to_url(target))
+        return split_res.path if split_res.hostname == "github.com" else None
+
+    def resolve(self, target: str, file: File, badge: Badge) -> Resolution:
+        return resolve_remote_full(target, badge) if is_url(target) else resolve_remote(target, badge)
+
+    def prefetch(self, target: str) -> None:
+        link = self.link(target)
+        entry = link_cache.get(link) if link is not None else None
+        if link is None or link in checked_links or (entry is not None and link_cache.is_fresh(entry)):
+            return
+        parts = link.split("/", 5)
+        if len(parts) == 6 and not parts[0] and parts[3] == "blob" and all(parts[1:]):
+            # Links of repos with local mirrors are checked with git (see check_mirrors).
+            if get_mirror(parts[1], parts[2]) is None:
+                scheduler.prefetch(link, (parts[1], parts[2], parts[4]))
+        else:
+            scheduler.prefetch(link)
+
+    def check_trees(self, links: List[str]) -> None:
+        """Checks links to notebooks of the same repo and ref (two or more) against a single listing of the repo tree.
+        Results are stored as checked links, the rest of the links are checked one by one.
+        """
+        from urllib.parse import unquote
+
+        groups: Dict[Tuple[str, str, str], List[Tuple[str, str]]] = {}
+        for link in links:
+            entry = link_cache.get(link)
+            if link in checked_links or (entry is not None and link_cache.is_fresh(entry)):
+                continue
+            # Link: /<owner>/<repo>/blob/<ref>/<path>, ref is taken up to the first slash.
+            parts = link.split("/", 5)
+            if len(parts) == 6 and not parts[0] and parts[3] == "blob" and all(parts[1:]):
+                groups.setdefault((parts[1], parts[2], parts[4]), []).append((link, unquote(parts[5])))
+        # Ref with a slash (e.g. feature/x) is split, listing of its first part is not found (git does not allow both
+        # feature and feature/x branches), links are checked one by one then.
+        groups = {key: group for key, group in groups.items() if len(group) > 1}
+        for key in groups:
+            scheduler.submit_tree(*key)
+        for key, group in groups.items():
+            tree = scheduler.tree(*key)
+            if tree is None:
+                continue
+            for link, path in group:
+                bad = None if path in tree else (404, "Not Found")
+                checked_links[link] = bad
+                link_cache.put(link, CacheEntry(time.time(), *(bad or (200, "OK"))))
+            count("tree_checks", len(group))
+
+    def resolve_many(self, targets: List[str], file: File, badge: Badge) -> Dict[str, Resolution]:
+        # Checks of a batch are all started before waiting for any of them (a single target is just checked).
+        if len(targets) > 1:
+            links = [link for link in map(self.link, targets) if link is not None]
+            check_mirrors(links)
+            self.check_trees(links)
+            for link in links:
+                if link not in checked_links:
+                    scheduler.submit(link)
+        return super().resolve_many(targets, file, badge)
+
+
+class LocalResolver(Resolver):
+    """Notebooks from the current repo (paths relative to the root), matches any target."""
+
+    def match(self, target: str) -> bool:
+        return True
+
+    def resolve(self, target: str, file: File, badge: Badge) -> Resolution:
+        return resolve_local(target, file, badge)
+
+
+# Resolvers of badge targets, the first matching one is used.
+resolvers: List[Resolver] = [DriveResolver(), GitHubResolver(), LocalResolver()]
+
+
+def register_resolver(resolver: Resolver, index: int = 0) -> None:
+    """Adds a resolver, by default before the others (it takes precedence)."""
+    resolvers.insert(index, resolver)
+
+
+def find_resolver(target: str) -> Resolver:
+    return next(resolver for resolver in resolvers if resolver.match(target))
+
+
+def resolve_target(nb_path: str, file: File, badge: Badge) -> Resolution:
+    """Resolves target of a badge tag (notebook from the repo, gdrive, or from another repo)."""
+    return find_resolver(nb_path).resolve_many([nb_path], file, badge)[nb_path]
+
+
+# Badge targets resolved in advance, for all the files at once: (repo, branch, target) -> resolution.
+resolved: Dict[Tuple[str, str, str], Resolution] = {}
+
+
+def resolve_targets(targets: Iterable[str], file: File, badge: Badge) -> None:
+    """Resolves distinct badge targets (for files of the same repo and branch), in batches per resolver.
+    Results are used when badges are applied (see make_badge).
+    """
+    batches: Dict[int, List[str]] = {}
+    for target in {target for target in targets if (file.repo, file.branch, target) not in resolved}:
+        resolver = find_resolver(target)
+        batches.setdefault(id(resolver), []).append(target)
+    for resolver in resolvers:
+        for target, resolution in resolver.resolve_many(batches.pop(id(resolver), []), file, badge).items():
+            resolved[(file.repo, file.branch, target)] = resolution
+
+
+# Badge tags and tracked badges found in advance (see resolve_files): path -> locations.
+located: Dict[str, List[Location]] = {}
+# Notebooks read by the scan, taken (not read again) when badges are applied: path -> data.
+parsed: Dict[str, Union[dict, LazyNotebook]] = {}
+
+
+def resolve_files(files: List[File], badge: Badge, patterns: Patterns, lazy: bool = False) -> None:
+    """Finds badge tags and tracked badges of the files (scan), and resolves their distinct targets at once, per repo
+    and branch (resolve). Locations are kept, so only these lines are checked when badges are applied.
+    """
+    groups: Dict[Tuple[str, str], List[File]] = {}
+    for file in files:
+        groups.setdefault((file.repo, file.branch), []).append(file)
+    for group in groups.values():
+        for file in group:
+            if file.path not in located:
+                located[file.path] = scan_file(file.path, patterns, lazy=lazy, parsed=parsed)
+                # Remote checks are started right away (in order of the file), the scan goes on meanwhile.
+                for target in dict.fromkeys(location.target for location in located[file.path] if location.target):
+                    find_resolver(target).prefetch(target)
+        targets = {location.target for file in group for location in located[file.path] if location.target}
+        count("targets", len(targets))
+        resolve_targets(targets, group[0], badge)
+
+
+def report_resolution(resolution: Resolution, line: Line, file: File, logger: Logger) -> Optional[str]:
+    """Returns url of a resolved target, errors are logged (for the line)."""
+    if resolution.url is None:
         line_num_str = str(line.num or "")
-        title = ":".join((file.path, line_num_str, " " + "File doesn't exist."))
-        logger.error(
-            f"Specified file {nb_path} doesn't exist in current repository.",
-            extra={"file": file.path, "line": line_num_str, "title": title},
-        )
-    return success
+        title = ":".join((file.path, line_num_str, " " + resolution.title))
+        logger.error(resolution.message, extra={"file": file.path, "line": line_num_str, "title": title})
+    return resolution.url
+
+
+def prepare_path_drive(nb_path: str, badge: Badge) -> Optional[str]:
+    return resolve_drive(nb_path, badge).url
+
+
+def prepare_path_remote(
+    match: re.Match, nb_path: str, line: Line, file: File, badge: Badge, logger: Logger
+) -> Optional[str]:
+    return report_resolution(resolve_remote(nb_path, badge), line, file, logger)
 
 
-def prepare_path_self(match: re.Match, line: Namespace, file: File, badge: Badge, logger: Logger) -> Optional[str]:
+def prepare_path_remote_full(
+    match: re.Match, nb_path: str, line: Line, file: File, badge: Badge, logger: Logger
+) -> Optional[str]:
+    return report_resolution(resolve_remote_full(nb_path, badge), line, file, logger)
+
+
+def prepare_path_local(
+    match: re.Match, nb_path: str, line: Line, file: File, badge: Badge, logger: Logger
+) -> Optional[str]:
+    return report_resolution(resolve_local(nb_path, file, badge), line, file, logger)
+
+
+def prepare_path_self(match: re.Match, line: Line, file: File, badge: Badge, logger: Logger) -> Optional[str]:
     success = None
     # Check file type.
     if file.type == "notebook":
@@ -249,99 +1569,97 @@ def prepare_path_self(match: re.Match, line: Namespace, file: File, badge: Badge
     return success
 
 
-def add_badge(line: Namespace, file: File, badge: Badge, patterns: Patterns, logger: Logger) -> Optional[Namespace]:
-    """Inserts "Open in Colab" badge."""
-    updated = False
-    badge_matches = patterns.badge.finditer(line.data)
-    for badge_match in badge_matches:
-        nb_path = badge_match["path"]
-        # Notebook from the repo, gdrive, or nb from another repo).
-        if nb_path:
-            # Notebook from gdrive or from repo.
-            if patterns.url.match(nb_path) is None:
-                # Notebook from gdrive or from remote repo.
-                if nb_path.startswith("/"):
-                    # Notebook from the google drive.
-                    if nb_path.startswith("//drive/"):
-                        nb_path_url = prepare_path_drive(nb_path, badge)
-                    # Notebook from remote repo.
-                    else:
-                        nb_path_url = prepare_path_remote(badge_match, nb_path, line, file, badge, logger)
-                # Notebook from local (repo) repo.
-                else:
-                    nb_path_url = prepare_path_local(badge_match, nb_path, line, file, badge, logger)
-            # Full url -> notebook from remote repo.
-            else:
-                nb_path_url = prepare_path_remote_full(badge_match, nb_path, line, file, badge, logger)
-            if nb_path_url is None:
-                continue
-            # Prepare code badge
-            badge_code = badge.md.safe_substitute(url=nb_path_url)
-        # Self-Notebook (notebook points to itself).
+def make_badge(
+    badge_match: re.Match, line: Line, file: File, badge: Badge, patterns: Patterns, logger: Logger
+) -> Optional[str]:
+    """Prepares badge code for a badge tag."""
+    nb_path = badge_match["path"]
+    # Notebook from the repo, gdrive, or nb from another repo (see resolvers).
+    if nb_path:
+        # Target resolved in advance (or right now, if it was missed, and kept for the next badges).
+        key = (file.repo, file.branch, nb_path)
+        resolution = resolved.get(key)
+        if resolution is None:
+            resolution = resolved[key] = resolve_target(nb_path, file, badge)
+        nb_path_url = report_resolution(resolution, line, file, logger)
+        if nb_path_url is None:
+            return None
+        # Prepare code badge
+        badge_code = badge.md.safe_substitute(url=nb_path_url)
+    # Self-Notebook (notebook points to itself).
+    else:
+        nb_path_url = prepare_path_self(badge_match, line, file, badge, logger)
+        if nb_path_url is None:
+            return None
+        # If track, add html code allowing tracking.
+        if file.track:
+            badge_code = badge.html.safe_substitute(url=nb_path_url)
+        # Otherwise use markdown code. Note: you cannot mix html and md.
         else:
-            nb_path_url = prepare_path_self(badge_match, line, file, badge, logger)
-            if nb_path_url is None:
-                continue
-            # If track, add html code allowing tracking.
-            if file.track:
-                badge_code = badge.html.safe_substitute(url=nb_path_url)
-            # Otherwise use markdown code. Note: you cannot mix html and md.
-            else:
-                badge_code = badge.md.safe_substitute(url=nb_path_url)
-        # Update line
-        line.data = line.data.replace(badge_match["badge"], badge_code, 1)
-        updated = True
-
-    return line if updated else None
+            badge_code = badge.md.safe_substitute(url=nb_path_url)
+    return badge_code
 
 
-def update_badge(line: Namespace, file: File, badge: Badge, patterns: Patterns) -> Optional[Namespace]:
-    """Updates added badge code."""
-    updated = False
+@lru_cache(maxsize=None)
+def get_self_url(file: File, badge: Badge) -> Tuple[str, str]:
+    """Returns notebook path and its url (computed once per file)."""
     file_path = append_ext_to_str(file.path)
-    new_href = badge.url.safe_substitute(repo=file.repo, branch=file.branch, file=file_path)
-
-    badges = patterns.tracked.findall(line.data)
-    if badges:
-        for b in badges:
-            href = patterns.href.findall(b)[0]
-            repo_branch_nb = href.split("/github/")[-1]
-            curr_repo, branch_nb = repo_branch_nb.split("/blob/")
-            curr_branch, curr_file_path = branch_nb.split("/", 1)
-
-            if (curr_repo != file.repo) or (curr_branch != file.branch) or (curr_file_path != file_path):
-                line.data = line.data.replace(href, new_href)
-                updated = True
+    return file_path, badge.url.safe_substitute(repo=file.repo, branch=file.branch, file=file_path)
 
-    return line if updated else None
 
+def update_tracked_badge(badge_code: str, file: File, badge: Badge, patterns: Patterns) -> Optional[str]:
+    """Updates href of a tracked badge code, None if it is up to date."""
+    file_path, new_href = get_self_url(file, badge)
+    href = patterns.href.findall(badge_code)[0]
+    repo_branch_nb = href.split("/github/")[-1]
+    curr_repo, branch_nb = repo_branch_nb.split("/blob/")
+    curr_branch, curr_file_path = branch_nb.split("/", 1)
 
-def check_md_line(line: Namespace, file: File, badge: Badge, patterns: Patterns, logger: Logger) -> Optional[Namespace]:
-    updated = False
-    # If a there is a badge - check the repo and the branch.
-    if file.track:
-        # Update repo, branch, file path.
-        new_line = update_badge(line, file, badge, patterns)
-        if new_line:
-            line = new_line
-            updated = True
-    # Add badge code.
-    new_line = add_badge(line, file, badge, patterns, logger)
-    if new_line:
-        line = new_line
-        updated = True
+    if (curr_repo != file.repo) or (curr_branch != file.branch) or (curr_file_path != file_path):
+        return badge_code.replace(href, new_href)
+    return None
 
-    return line if updated else None
 
+def check_md_line(line: Line, file: File, badge: Badge, patterns: Patterns, logger: Logger) -> Optional[Line]:
+    """Updates tracked badges and inserts badges (single pass over the line)."""
+    data = line.data
+    if "{{" not in data and "<!--<badge>-->" not in data:
+        return None
 
-def check_cell(cell: dict, file: File, badge: Badge, patterns: Patterns, logger: Logger) -> Optional[dict]:
-    """Updates/Adds badge for jupyter markdown cell."""
+    chunks, pos = [], 0
+    for match in patterns.combined.finditer(data):
+        # If a there is a badge - check the repo and the branch.
+        if match["tracked"] is not None:
+            if not file.track:
+                continue
+            # Update repo, branch, file path.
+            badge_code = update_tracked_badge(match["tracked"], file, badge, patterns)
+        # Add badge code.
+        else:
+            badge_code = make_badge(match, line, file, badge, patterns, logger)
+        if badge_code is None:
+            continue
+        if stats is not None:
+            stats.add("badges_updated" if match["tracked"] is not None else "badges_added")
+        chunks += [data[pos:match.start()], badge_code]
+        pos = match.end()
+
+    if not chunks:
+        return None
+    line.data = "".join(chunks) + data[pos:]
+    return line
+
+
+def check_cell(
+    cell: dict, file: File, badge: Badge, patterns: Patterns, logger: Logger, lines: Optional[Iterable[int]] = None
+) -> Optional[dict]:
+    """Updates/Adds badge for jupyter markdown cell (only given lines, if any)."""
     updated = False
     # Get source.
     text = cell["source"]
-    # Iterate over source lines.
-    for i, l in enumerate(text):
-        line = Namespace(**{"data": l, "num": 1})
+    # Iterate over source lines with badges only.
+    for i in find_lines(text, patterns) if lines is None else lines:
+        line = Line(text[i], 1)
         new_line = check_md_line(line, file, badge, patterns, logger)
         if new_line:
             text[i] = new_line.data
@@ -350,12 +1668,14 @@ def check_cell(cell: dict, file: File, badge: Badge, patterns: Patterns, logger:
     return cell if updated else None
 
 
-def check_md(text: List[str], file: File, badge: Badge, patterns: Patterns, logger: Logger) -> Optional[List[str]]:
-    """Updates/Adds badge for markdown file."""
+def check_md(
+    text: List[str], file: File, badge: Badge, patterns: Patterns, logger: Logger, lines: Optional[Iterable[int]] = None
+) -> Optional[List[str]]:
+    """Updates/Adds badge for markdown file (only given lines, if any)."""
     updated = False
-    # Iterate over source lines.
-    for i, l in enumerate(text):
-        line = Namespace(**{"data": l, "num": i + 1})
+    # Iterate over source lines with badges only.
+    for i in find_lines(text, patterns) if lines is None else lines:
+        line = Line(text[i], i + 1)
         new_line = check_md_line(line, file, badge, patterns, logger)
         if new_line:
             text[i] = new_line.data
@@ -364,14 +1684,49 @@ def check_md(text: List[str], file: File, badge: Badge, patterns: Patterns, logg
     return text if updated else None
 
 
+def check_md_stream(path: str, file: File, badge: Badge, patterns: Patterns, logger: Logger) -> bool:
+    """Updates/Adds badges of a markdown file line by line, lines are written to a temporary file, which replaces
+    the original one only if a line was modified (otherwise it is discarded). Returns whether the file was modified.
+    """
+    import tempfile
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    updated = False
+    try:
+        with open(path, "r") as src, os.fdopen(fd, "w") as dst:
+            # Lines are counted by the scan (see find_locations).
+            for num, data in enumerate(src, 1):
+                new_line = check_md_line(Line(data, num), file, badge, patterns, logger)
+                if new_line:
+                    data = new_line.data
+                    updated = True
+                dst.write(data)
+        if updated:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+            os.replace(tmp_path, path)
+    finally:
+        # Not modified (or failed).
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return updated
+
+
 def check_cells(
-    cells: List[dict], file: File, badge: Badge, patterns: Patterns, logger: Logger
+    cells: List[dict],
+    file: File,
+    badge: Badge,
+    patterns: Patterns,
+    logger: Logger,
+    lines: Optional[Dict[int, List[int]]] = None,
 ) -> Optional[List[dict]]:
     updated = False
     for cell_idx, cell in enumerate(cells):
-        # Check only markdown cells.
-        if cell["cell_type"] == "markdown":
-            new_cell = check_cell(cell, file, badge, patterns, logger)
+        # Check only markdown cells (only cells with given lines, if any).
+        if cell["cell_type"] == "markdown" and (lines is None or cell_idx in lines):
+            if lines is None:
+                new_cell = check_cell(cell, file, badge, patterns, logger)
+            else:
+                new_cell = check_cell(cell, file, badge, patterns, logger, lines[cell_idx])
             if new_cell is not None:
                 cell = new_cell
                 cells[cell_idx] = cell
@@ -380,3 +1735,256 @@ def check_cells(
             continue
 
     return cells if updated else None
+
+
+class LogCapture(Handler):
+    """Collects log records, so they can be replayed later (e.g. in the main process)."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[LogRecord] = []
+
+    def emit(self, record: LogRecord) -> None:
+        # Render message right away, record has to be picklable.
+        record.msg, record.args, record.exc_info = record.getMessage(), None, None
+        self.records.append(record)
+
+
+def get_workers(value: str) -> int:
+    """Parses number of workers: "auto" | positive integer."""
+    if value in ("", "auto"):
+        return os.cpu_count() or 1
+    workers = int(value) if value.isdigit() else 0
+    if workers < 1:
+        raise ValueError(f"{value} is a wrong value. Expecting auto or a positive integer")
+    return workers
+
+
+class FileResult(NamedTuple):
+    # Captured log records.
+    records: List[LogRecord]
+    # Link cache entries added while processing the file.
+    links: Dict[str, CacheEntry]
+    # Git blob id of the saved file (None if the file was not modified).
+    blob: Optional[str] = None
+    # Stats collected while processing the file (None if disabled).
+    stats: Optional[dict] = None
+
+
+def git_blob_id(path: str) -> str:
+    """Computes git blob id of a file (as git hash-object does), the file is read in chunks."""
+    import hashlib
+
+    with open(path, "rb") as f:
+        sha1 = hashlib.sha1(b"blob %d\0" % os.fstat(f.fileno()).st_size)
+        for chunk in iter(partial(f.read, 2**16), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_blob_ids(root_dir: Optional[str] = None) -> Dict[str, str]:
+    """Get git blob ids of all the files from git index (single call), files modified in the work tree are omitted."""
+    import subprocess
+
+    try:
+        res = subprocess.run(["git", "ls-files", "-s", "-z"], cwd=root_dir, capture_output=True)
+        modified = subprocess.run(["git", "ls-files", "-m", "-z"], cwd=root_dir, capture_output=True)
+    except OSError:
+        return {}
+    if res.returncode != 0 or modified.returncode != 0:
+        return {}
+    skip = set(os.fsdecode(modified.stdout).split("\0"))
+    blobs = {}
+    for entry in os.fsdecode(res.stdout).split("\0"):
+        if not entry:
+            continue
+        # <mode> <blob id> <stage>\t<path>
+        meta, path = entry.split("\t", 1)
+        if path not in skip:
+            blobs[path] = meta.split()[1]
+    return blobs
+
+
+@lru_cache(maxsize=None)
+def get_tool_version() -> str:
+    """Version of the badge logic (hash of the source), any change invalidates the manifest."""
+    import hashlib
+
+    with open(__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+class Manifest:
+    """Manifest of processed files: path -> blob id of the file and the inputs it was processed with."""
+
+    version = 1
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.files: Dict[str, dict] = {}
+
+    def load(self) -> None:
+        """Loads manifest file, missing or broken file means an empty manifest."""
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.files = {path: dict(entry) for path, entry in data["files"].items()}
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            self.files = {}
+
+    def save(self) -> None:
+        """Saves manifest file (atomically)."""
+        if not self.path:
+            return
+        write_atomic(json.dumps({"version": self.version, "files": self.files}).encode(), self.path)
+
+    def is_up_to_date(self, path: str, blob: Optional[str], inputs: dict) -> bool:
+        """Checks whether the file has been already processed (same content, same inputs)."""
+        return bool(self.path) and blob is not None and self.files.get(path) == {"blob": blob, "inputs": inputs}
+
+    def update(self, path: str, blob: Optional[str], inputs: dict) -> None:
+        if not self.path:
+            return
+        if blob is None:
+            self.files.pop(path, None)
+        else:
+            self.files[path] = {"blob": blob, "inputs": inputs}
+
+
+def init_worker(
+    cache: LinkCache,
+    remote_scheduler: RemoteScheduler,
+    notebooks: Optional[NotebookIndex] = None,
+    collect_stats: bool = False,
+    targets: Optional[Dict[Tuple[str, str, str], Resolution]] = None,
+    remote_mirrors: Optional[List[Tuple[str, str]]] = None,
+    locations: Optional[Dict[str, List[Location]]] = None,
+) -> None:
+    """Worker process initializer, shares the link cache, scheduler settings, notebooks index, resolved targets,
+    mirrors and badges locations of the main process.
+    """
+    global link_cache, scheduler, nb_index, stats, mirrors
+    link_cache, scheduler, nb_index, mirrors = cache, remote_scheduler, notebooks, remote_mirrors or []
+    resolved.update(targets or {})
+    located.update(locations or {})
+    # Workers collect their own stats (returned per file).
+    stats = Stats() if collect_stats else None
+
+
+# Markdown files larger than this (in bytes) are rewritten line by line, with bounded memory (see check_md_stream).
+md_stream_size = 16 * 2**20
+
+
+def process_file(
+    file: File, badge: Badge, patterns: Patterns, verbose: bool = False, lazy: bool = False
+) -> FileResult:
+    """Reads, checks and saves (if necessary) a single file."""
+    # Stats of the file are collected apart (returned with the result).
+    with local_stats() as file_stats:
+        capture = LogCapture()
+        # Standalone loggers (not registered, no propagation), both share the same handler to keep the order.
+        logger_action, logger_badge = Logger("action", INFO if verbose else WARNING), Logger("badge")
+        logger_action.addHandler(capture)
+        logger_badge.addHandler(capture)
+
+        if memory_peaks is not None:
+            import tracemalloc
+
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        logger_action.info(f"{file.path}: Reading...")
+        size = os.path.getsize(file.path)
+        if stats is not None:
+            stats.add("files_read")
+            stats.add("bytes_read", size)
+
+        # Large markdown files are rewritten line by line (never loaded as a whole).
+        if file.type == "md" and size > md_stream_size:
+            with span("check"):
+                written = check_md_stream(file.path, file, badge, patterns, logger_badge)
+            if written:
+                logger_action.info(f"{file.path} Saving...")
+        else:
+            with span("read"):
+                data = parsed.pop(file.path, None) or read_file(file.path, lazy=lazy)
+            # Locate and resolve targets of the file missed by the scan (if any), all at once.
+            locations = located.get(file.path)
+            if locations is None:
+                locations = locate(data, patterns)
+                resolve_targets({location.target for location in locations if location.target}, file, badge)
+            lines: Dict[Optional[int], List[int]] = {}
+            for location in locations:
+                if location.line not in lines.setdefault(location.cell, []):
+                    lines[location.cell].append(location.line)
+            new_data: Union[dict, LazyNotebook, List[str], None] = None
+            if isinstance(data, list):
+                with span("check"):
+                    # Lines are checked in place (the list is not used after).
+                    new_data = check_md(data, file, badge, patterns, logger_badge, lines.get(None, []))
+            else:
+                nb_cells = data.cells if isinstance(data, LazyNotebook) else data["cells"]
+                cell_lines = {cell: cell_lines for cell, cell_lines in lines.items() if cell is not None}
+                with span("check"):
+                    cells = check_cells(nb_cells, file, badge, patterns, logger_badge, cell_lines)
+                if cells:
+                    if isinstance(data, dict):
+                        data["cells"] = cells
+                    new_data = data
+            written = bool(new_data)
+            if new_data:
+                logger_action.info(f"{file.path} Saving...")
+                with span("write"):
+                    write_file(new_data, file.path)
+
+        blob = None
+        if written:
+            blob = git_blob_id(file.path)
+            if stats is not None:
+                stats.add("files_written")
+                stats.add("bytes_written", os.path.getsize(file.path))
+        else:
+            logger_action.info(f"{file.path}: Nothing to add...")
+
+        if memory_peaks is not None:
+            memory_peaks[file.path] = tracemalloc.get_traced_memory()[1] - start_memory
+
+    return FileResult(
+        records=capture.records,
+        links=link_cache.pop_updates(),
+        blob=blob,
+        stats=file_stats.pop() if file_stats is not None else None,
+    )
+
+
+def process_files(
+    files: List[File], badge: Badge, patterns: Patterns, verbose: bool = False, workers: int = 1, lazy: bool = False
+) -> Iterator[FileResult]:
+    """Processes files (in a pool of processes if workers > 1). Yields results in input order.
+
+    Files are processed in three phases: badge tags of all the files are located (scan), distinct targets are
+    resolved at once, remote ones concurrently (resolve), and then located lines are checked and badges are applied
+    (apply). Scan and resolve are skipped for files already resolved (see resolve_files).
+    """
+    job = partial(process_file, badge=badge, patterns=patterns, verbose=verbose, lazy=lazy)
+    unresolved = [file for file in files if file.path not in located]
+    if unresolved:
+        with span("resolve"):
+            resolve_files(unresolved, badge, patterns, lazy=lazy)
+    workers = min(workers, len(files))
+    if workers > 1:
+        initargs = (link_cache, scheduler, nb_index, stats is not None, resolved, mirrors, located)
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Workers are forked, threads of the scheduler must not be running.
+        scheduler.shutdown()
+
+        # Notebooks read by the scan are not passed (too large to pickle), forked workers inherit them.
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+            yield from executor.map(job, files, chunksize=max(1, len(files) // (workers * 4)))
+        parsed.clear()
+    else:
+        yield from map(job, files)
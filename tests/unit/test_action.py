@@ -0,0 +1,23 @@
+import re
+
+
+def read_action(path):
+    """Returns inputs section and the rest of action metadata file."""
+    with open(path) as f:
+        text = f.read()
+    start, end = text.index("inputs:"), text.index("runs:")
+    return text[start:end], text[end:]
+
+
+def test_composite_action():
+    inputs, _ = read_action("action.yml")
+    composite_inputs, composite_runs = read_action("composite/action.yml")
+    # Both runtimes have the same inputs.
+    assert composite_inputs == inputs
+    # Every input read by the action is passed to it (as INPUT_* variables, like docker actions get them).
+    with open("src/action.py") as f:
+        used = set(re.findall(r'os.environ\["(INPUT_\w+)"\]', f.read()))
+    env = dict(re.findall(r"^ +(INPUT_\w+): \$\{\{ inputs\.(\w+) \}\}$", composite_runs, re.M))
+    assert set(env) == used
+    assert all(name == f"INPUT_{value.upper()}" for name, value in env.items())
+    assert set(re.findall(r"^  (\w+):$", inputs, re.M)) == set(env.values())
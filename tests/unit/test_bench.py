@@ -0,0 +1,36 @@
+import json
+import sys
+
+sys.path.append("benchmarks")
+import bench
+
+
+def test_generate(tmp_path):
+    config = bench.Config(notebooks=3, mds=2, cells=4, badge_density=1.0, tracked_ratio=0.0)
+    bench.generate(str(tmp_path), config)
+    nbs, mds = sorted(tmp_path.glob("nbs/*/*.ipynb")), sorted(tmp_path.glob("docs/*/*.md"))
+    assert len(nbs) == 3 and len(mds) == 2
+    cells = json.loads(nbs[0].read_text())["cells"]
+    assert [cell["cell_type"] for cell in cells] == ["markdown", "code"] * 2
+    assert all(line.startswith("{{ badge") for line in mds[0].read_text().splitlines())
+
+
+def test_benchmark():
+    config = bench.Config(notebooks=4, mds=4, cells=4, remote_links=4)
+    results = bench.benchmark(config, repeat=1)
+    assert results["config"] == config._asdict()
+    assert [*results["stages"]] == [*bench.STAGES]
+    assert results["stages"]["discovery"]["files"] == 8
+    assert results["stages"]["resolve"]["files"] == results["stages"]["read"]["files"] > 0
+    assert results["stages"]["read"]["bytes"] > 0
+    assert results["stages"]["remote"]["files"] == 4
+    assert "ratio" in bench.compare(results, results)
+
+
+def test_benchmark_reset_caches():
+    config = bench.Config(notebooks=4, mds=4, cells=4, remote_links=1)
+    bench.benchmark(config, repeat=1)
+    # Each run starts from scratch, nothing is kept from the previous one.
+    bench.reset_caches()
+    assert not bench.lib.resolved and not bench.lib.located and not bench.lib.parsed
+    assert bench.lib.append_ext_to_str.cache_info().currsize == 0
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+import pytest
+
+sys.path.append("src")
+import cli
+import lib
+
+
+@pytest.fixture(autouse=True)
+def reset(monkeypatch):
+    monkeypatch.setattr(lib, "scheduler", lib.RemoteScheduler(backoff=0))
+    lib.checked_links.clear()
+
+
+def test_main(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "nb.ipynb").write_text("{}")
+    (tmp_path / "a.md").write_text("{{ badge nb }}\n")
+    (tmp_path / "b.md").write_text("{{ badge missing }}\n")
+    (tmp_path / "c.md").write_text("no badges\n")
+    (tmp_path / "d.txt").write_text("{{ badge nb }}\n")
+
+    assert cli.main(["c.md", "d.txt", "--repo", "u/r", "--branch", "main"]) == 0
+    assert cli.main(["a.md", "--repo", "u/r", "--branch", "main"]) == 1
+    assert (tmp_path / "a.md").read_text() == (
+        "[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]"
+        "(https://colab.research.google.com/github/u/r/blob/main/nb.ipynb)\n"
+    )
+    # Nothing to do.
+    assert cli.main(["a.md", "--repo", "u/r", "--branch", "main"]) == 0
+    assert cli.main(["b.md", "--repo", "u/r", "--branch", "main"]) == 1
+    assert "b.md:1: Specified file missing doesn't exist in current repository." in capsys.readouterr().err
+    assert (tmp_path / "d.txt").read_text() == "{{ badge nb }}\n"
+
+
+def test_main_no_repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.md").write_text("{{ badge nb }}\n")
+    monkeypatch.setattr(cli, "get_origin_repo", lambda: None)
+    assert cli.main(["a.md", "--branch", "main"]) == 2
+
+
+def test_lazy_imports():
+    code = "import sys, cli; print(sorted({'http.client', 'subprocess', 'concurrent.futures'} & set(sys.modules)))"
+    res = subprocess.run([sys.executable, "-c", code], cwd="src", capture_output=True, check=True)
+    assert res.stdout.decode().strip() == "[]"
@@ -1,18 +1,24 @@
+import http.client
 import json
 import logging
+import os
+import pickle
 import string
+import subprocess
 import sys
 from argparse import Namespace
 
 import pytest
 
 sys.path.append("src")
+sys.path.append("benchmarks")
 import lib
+from fake_github import FakeGitHub
 from lib import (
     Badge,
     File,
+    Location,
     Patterns,
-    add_badge,
     append_ext_to_str,
     append_ext_to_url,
     check_cell,
@@ -22,23 +28,38 @@ from lib import (
     check_nb_link,
     get_all_mds,
     get_all_nbs,
-    get_modified_mds,
-    get_modified_nbs,
+    get_workers,
     prepare_path_drive,
     prepare_path_local,
     prepare_path_remote,
     prepare_path_remote_full,
     prepare_path_self,
+    process_file,
+    process_files,
     read_file,
     read_md,
     read_nb,
-    update_badge,
     write_file,
     write_md,
     write_nb,
 )
 
 
+@pytest.fixture(autouse=True)
+def checked_links(monkeypatch):
+    """Forget links checked by other tests."""
+    monkeypatch.setattr(lib, "scheduler", lib.RemoteScheduler(backoff=0, api_host=""))
+    monkeypatch.setattr(lib, "nb_index", None)
+    monkeypatch.setattr(lib, "stats", None)
+    monkeypatch.setattr(lib, "resolved", {})
+    monkeypatch.setattr(lib, "located", {})
+    monkeypatch.setattr(lib, "parsed", {})
+    monkeypatch.setattr(lib, "mirrors", [])
+    lib.checked_links.clear()
+    yield lib.checked_links
+    lib.checked_links.clear()
+
+
 @pytest.fixture
 def badge():
     return Badge()
@@ -139,6 +160,110 @@ def test_write_nb(tmp_path, min_nb):
     assert nb == expected
 
 
+@pytest.fixture
+def nb_with_outputs():
+    """Notebook with code cells, outputs and markdown cells."""
+    return {
+        "cells": [
+            {"cell_type": "markdown", "metadata": {}, "source": ["# Title {\"]}\n", "{{ badge }}\n", "\u00e9"]},
+            {
+                "cell_type": "code",
+                "execution_count": 1,
+                "metadata": {"tags": ["[x]"]},
+                "outputs": [{"data": {"image/png": "iVBOR\\\"]}" * 1000}, "output_type": "display_data"}],
+                "source": ["{{ badge nb }}"],
+            },
+            {"source": "{{ badge //drive/0000 }}\nfoo", "metadata": {}, "cell_type": "markdown"},
+            {"cell_type": "raw", "metadata": {}, "source": []},
+        ],
+        "metadata": {"kernelspec": {"name": "python3"}, "x": [1, 2.5e3, True, None]},
+        "nbformat": 4,
+        "nbformat_minor": 5,
+    }
+
+
+@pytest.mark.parametrize("indent", [None, 1, 2])
+def test_read_nb_lazy(tmp_path, nb_with_outputs, indent):
+    file_path = tmp_path / "nb.ipynb"
+    file_path.write_text(json.dumps(nb_with_outputs, indent=indent))
+
+    nb = lib.read_nb_lazy(str(file_path))
+
+    assert isinstance(nb, lib.LazyNotebook)
+    assert nb.cells == [
+        {"cell_type": "markdown", "source": ["# Title {\"]}\n", "{{ badge }}\n", "\u00e9"]},
+        {"cell_type": "code"},
+        {"cell_type": "markdown", "source": ["{{ badge //drive/0000 }}\n", "foo"]},
+        {"cell_type": "raw"},
+    ]
+    assert [span is not None for span in nb.spans] == [True, False, True, False]
+    assert nb.sources == [cell.get("source") for cell in nb.cells]
+
+
+@pytest.mark.parametrize("content", ['{"cells": {}}', '{"cells": [1]}', "[]"])
+def test_read_nb_lazy_fallback(tmp_path, content):
+    file_path = tmp_path / "nb.ipynb"
+    file_path.write_text(content)
+    assert lib.read_nb_lazy(str(file_path)) == json.loads(content)
+
+
+def test_write_nb_lazy(tmp_path, nb_with_outputs, file, badge, patterns, logger):
+    file_path = tmp_path / "nb.ipynb"
+    file_path.write_text(json.dumps(nb_with_outputs, indent=1))
+    mtime = file_path.stat().st_mtime_ns
+
+    nb = lib.read_nb_lazy(str(file_path))
+    lib.write_nb_lazy(nb, str(file_path))
+    # Nothing changed, nothing written.
+    assert file_path.stat().st_mtime_ns == mtime
+
+    nb = lib.read_nb_lazy(str(file_path))
+    cells = check_cells(nb.cells, file=file(track=False), badge=badge, patterns=patterns, logger=logger)
+    assert cells is not None
+    lib.write_nb_lazy(nb, str(file_path))
+
+    # Lazy reader splits string sources into lines (joined back on save).
+    source = nb_with_outputs["cells"][2]["source"]
+    nb_with_outputs["cells"][2]["source"] = source.splitlines(keepends=True)
+    expected = check_cells(nb_with_outputs["cells"], file(track=False), badge, patterns, logger)
+    expected[2]["source"] = "".join(expected[2]["source"])
+    assert json.loads(file_path.read_text()) == {**nb_with_outputs, "cells": expected}
+    assert [*tmp_path.iterdir()] == [file_path]
+
+
+def test_write_nb_lazy_splice(tmp_path, file, badge, patterns, logger):
+    # Original formatting (indentation, non-ascii chars, escapes) is preserved.
+    content = (
+        '{\n "cells": [\n  {\n   "cell_type": "markdown",\n   "metadata": {},\n   "source": [\n'
+        '    "Привет \\u00e9\\n",\n    "{{ badge }}"\n   ]\n  }\n ],\n "metadata": {},\n'
+        ' "nbformat": 4,\n "nbformat_minor": 5\n}\n'
+    )
+    file_path = tmp_path / "nb.ipynb"
+    file_path.write_text(content, encoding="utf-8")
+    file_path.chmod(0o640)
+
+    nb = lib.read_nb_lazy(str(file_path))
+    check_cells(nb.cells, file=file(path="nbs/nb.ipynb", track=False), badge=badge, patterns=patterns, logger=logger)
+    lib.write_nb_lazy(nb, str(file_path))
+
+    url = "https://colab.research.google.com/github/usr/repo/blob/main/nbs/nb.ipynb"
+    badge_code = json.dumps(badge.md.safe_substitute(url=url))
+    assert file_path.read_text(encoding="utf-8") == content.replace('"{{ badge }}"', badge_code)
+    assert file_path.stat().st_mode & 0o777 == 0o640
+
+
+def test_write_atomic(tmp_path, monkeypatch):
+    file_path = tmp_path / "file.md"
+    file_path.write_bytes(b"foo")
+    with monkeypatch.context() as m:
+        m.setattr(lib.os, "replace", lambda src, dst: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            lib.write_atomic(b"bar", str(file_path))
+    assert [*tmp_path.iterdir()] == [file_path]
+    lib.write_atomic(b"bar", str(file_path))
+    assert file_path.read_bytes() == b"bar"
+
+
 def test_read_md(tmp_path, min_md):
     expected = min_md
     fname = "file.md"
@@ -192,20 +317,275 @@ def test_get_all_mds(make_tmp_md):
     assert mds == [file.name for file in expected]
 
 
-def test_get_modified_nbs(monkeypatch, make_tmp_nb):
-    expected = [str(make_tmp_nb(file)) for file in string.ascii_lowercase]
+@pytest.fixture
+def git_repo(tmp_path):
+    """Git repo with a few commits."""
+
+    def git(*args):
+        cmd = ["git", "-c", "user.name=u", "-c", "user.email=u@e", *args]
+        return subprocess.run(cmd, cwd=tmp_path, check=True, capture_output=True).stdout.decode().strip()
+
+    git("init", "-q")
+    for i, files in enumerate([["a.md", "b.md", "nb.ipynb"], ["a.md", "c.md"], ["nb2.ipynb"]]):
+        for file in files:
+            (tmp_path / file).write_text(f"{file} {i}\n" * 10)
+        git("add", "-A")
+        git("commit", "-q", "-m", str(i))
+    git("mv", "b.md", "d.md")
+    git("commit", "-q", "-m", "mv")
+    return tmp_path, git
+
+
+def test_get_changed_files(git_repo, caplog, monkeypatch):
+    root, git = git_repo
+    assert lib.get_changed_files(root_dir=str(root)) == ["d.md"]
+    assert sorted(lib.get_changed_files("HEAD~3..HEAD", root_dir=str(root))) == ["a.md", "c.md", "d.md", "nb2.ipynb"]
+    # Unknown range (e.g. shallow clone), the current commit.
+    assert lib.get_changed_files("0123456..HEAD", root_dir=str(root)) == ["d.md"]
+    assert "0123456..HEAD" in caplog.records[-1].getMessage()
+    # No git.
+    monkeypatch.setenv("PATH", "")
+    assert lib.get_changed_files(root_dir=str(root)) == []
+
+
+def test_get_ref_files(git_repo):
+    root, git = git_repo
+    head = git("rev-parse", "HEAD")
+    git("checkout", "-q", "-b", "docs", "HEAD~3")
+    (root / "new.ipynb").write_text("{}")
+    assert lib.get_ref_files("docs", (".ipynb",), root_dir=str(root)) == ["nb.ipynb"]
+    assert sorted(lib.get_ref_files("docs", (".ipynb", ".md"), root_dir=str(root))) == ["a.md", "b.md", "nb.ipynb"]
+    # Remote branch.
+    git("update-ref", "refs/remotes/origin/gh-pages", head)
+    assert sorted(lib.get_ref_files("gh-pages", (".ipynb",), root_dir=str(root))) == ["nb.ipynb", "nb2.ipynb"]
+    assert lib.get_ref_files("missing", (".ipynb",), root_dir=str(root)) is None
+
+
+def test_lookup_blobs(git_repo, tmp_path_factory):
+    root, git = git_repo
+    names = ["HEAD:nb.ipynb", "HEAD:missing.ipynb", "HEAD~3:nb2.ipynb", "HEAD:", "missing:nb.ipynb"]
+    assert lib.lookup_blobs(names, root_dir=str(root)) == [True, False, False, False, False]
+    assert lib.lookup_blobs(names, root_dir=str(tmp_path_factory.mktemp("empty"))) is None
+
+
+def test_setup_mirrors():
+    lib.setup_mirrors(["usr/repo=/mirrors/repo.git", " usr/* = /mirrors/{owner}/{repo}.git"])
+    assert lib.get_mirror("usr", "repo") == "/mirrors/repo.git"
+    assert lib.get_mirror("usr", "repo2") == "/mirrors/usr/repo2.git"
+    assert lib.get_mirror("usr2", "repo") is None
+    with pytest.raises(ValueError, match="is a wrong value"):
+        lib.setup_mirrors(["usr/repo"])
+
+
+def test_check_mirrors_fake_github(git_repo, fake_github, tmp_path_factory, file, badge):
+    root, git = git_repo
+    git("branch", "-m", "main")
+    git("branch", "feature/x", "HEAD~3")
+    mirrors = tmp_path_factory.mktemp("mirrors")
+    git("clone", "-q", "--bare", str(root), str(mirrors / "usr" / "repo.git"))
+    server = fake_github()
+    lib.setup_mirrors([f"usr/*={mirrors}/{{owner}}/{{repo}}.git"])
+    targets = [
+        "/usr/repo/blob/main/nb",
+        "https://github.com/usr/repo/blob/main/nb2.ipynb",
+        "/usr/repo/blob/main/missing",
+        "/usr/repo/blob/feature/x/nb.ipynb",
+        "/usr/repo/blob/feature/x/nb2.ipynb",
+        # Missing mirror.
+        "/usr/repo2/blob/main/nb",
+        # Not mirrored.
+        "/usr2/repo/blob/main/nb",
+    ]
+    lib.resolve_targets(targets, file(), badge)
+    errors = {target for target in targets if lib.resolved[("usr/repo", "main", target)].url is None}
+    assert errors == {"/usr/repo/blob/main/missing", "/usr/repo/blob/feature/x/nb2.ipynb"}
+    requests = sorted(request[1] for request in server.requests)
+    assert requests == ["/usr/repo2/blob/main/nb.ipynb", "/usr2/repo/blob/main/nb.ipynb"]
+    # Single link.
+    assert check_nb_link("/usr/repo/blob/feature/x/nb.ipynb") is None
+    assert check_nb_link("/usr/repo/blob/main/nb3.ipynb") == (404, "Not Found")
+    assert server.count() == 2
+
+
+def test_get_origin_repo(git_repo):
+    root, git = git_repo
+    assert lib.get_origin_repo(str(root)) is None
+    git("remote", "add", "origin", "https://example.com/usr/repo.git")
+    assert lib.get_origin_repo(str(root)) is None
+    for url in ["https://github.com/usr/repo.git", "git@github.com:usr/repo.git", "https://github.com/usr/repo/"]:
+        git("remote", "set-url", "origin", url)
+        assert lib.get_origin_repo(str(root)) == "usr/repo"
+
+
+def test_get_default_branch(git_repo):
+    root, git = git_repo
+    git("checkout", "-q", "-b", "feature")
+    assert lib.get_default_branch(str(root)) == "feature"
+    git("update-ref", "refs/remotes/origin/main", "HEAD")
+    git("symbolic-ref", "refs/remotes/origin/HEAD", "refs/remotes/origin/main")
+    assert lib.get_default_branch(str(root)) == "main"
+    assert lib.get_default_branch(str(root / "missing")) is None
+
+
+def test_git_blob_id(git_repo):
+    root, git = git_repo
+    assert lib.git_blob_id(str(root / "a.md")) == git("hash-object", "a.md")
+
+
+def test_get_blob_ids(git_repo):
+    root, git = git_repo
+    (root / "a.md").write_text("modified")
+    blobs = lib.get_blob_ids(str(root))
+    assert sorted(blobs) == ["c.md", "d.md", "nb.ipynb", "nb2.ipynb"]
+    assert blobs["c.md"] == git("hash-object", "c.md")
+
+
+def test_manifest(tmp_path):
+    inputs = {"repo": "usr/repo", "branch": "main", "track": True, "version": lib.get_tool_version()}
+    manifest = lib.Manifest(str(tmp_path / "manifest.json"))
+    manifest.load()
+    assert not manifest.is_up_to_date("a.md", "abc", inputs)
+    manifest.update("a.md", "abc", inputs)
+    manifest.update("b.md", "def", inputs)
+    manifest.update("b.md", None, inputs)
+    manifest.save()
+
+    manifest = lib.Manifest(str(tmp_path / "manifest.json"))
+    manifest.load()
+    assert manifest.is_up_to_date("a.md", "abc", inputs)
+    assert not manifest.is_up_to_date("a.md", "abd", inputs)
+    assert not manifest.is_up_to_date("a.md", "abc", {**inputs, "branch": "dev"})
+    assert not manifest.is_up_to_date("a.md", None, inputs)
+    assert not manifest.is_up_to_date("b.md", "def", inputs)
+    # Disabled.
+    assert not lib.Manifest().is_up_to_date("a.md", "abc", inputs)
+
+
+def test_get_modified_files(monkeypatch, git_repo):
+    root, git = git_repo
+    monkeypatch.chdir(root)
+    assert lib.get_modified_files("HEAD~2..HEAD") == (["nb2.ipynb"], ["d.md"])
+
+
+@pytest.mark.parametrize(
+    "event, expected",
+    [
+        ({"before": "abc", "after": "def"}, "abc..def"),
+        ({"before": "0000000000", "after": "def"}, None),
+        ({"ref": "main"}, None),
+        (None, None),
+    ],
+)
+def test_get_push_range(tmp_path, event, expected):
+    event_path = tmp_path / "event.json"
+    if event is not None:
+        event_path.write_text(json.dumps(event))
+    assert lib.get_push_range(str(event_path)) == expected
+    assert lib.get_push_range(None) is None
+
+
+@pytest.mark.parametrize(
+    "path, patterns, expected",
+    [
+        ("a/b/c.md", ["vendor"], False),
+        ("a/vendor/c.md", ["vendor"], True),
+        ("a/b/c.md", ["*.md"], True),
+        ("a/b/c.md", ["a/b"], True),
+        ("a/b/c.md", ["a/b/"], True),
+        ("a/b/c.md", ["b/c.md"], False),
+        ("a/b/c.md", ["a/**"], True),
+        ("a/b/c.md", ["x", "a/*/c.md"], True),
+        ("a/.ipynb_checkpoints/nb-checkpoint.ipynb", [".ipynb_checkpoints"], True),
+        ("a.md", [], False),
+    ],
+)
+def test_match_globs(path, patterns, expected):
+    assert lib.match_globs(path, patterns) is expected
+
+
+def test_filter_globs():
+    paths = ["a.md", "docs/b.md", "docs/build/c.md", "d.ipynb"]
+    assert lib.filter_globs(paths) == paths
+    assert lib.filter_globs(paths, include=["docs"]) == ["docs/b.md", "docs/build/c.md"]
+    assert lib.filter_globs(paths, include=["docs"], exclude=["build"]) == ["docs/b.md"]
+    assert lib.filter_globs(paths, exclude=["*.md"]) == ["d.ipynb"]
+
+
+def test_split_globs():
+    assert lib.split_globs("") == []
+    assert lib.split_globs("a/**, b\n\n*.md\n") == ["a/**", "b", "*.md"]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Directory tree with notebooks and markdown files."""
+    for name in ["a.md", "nb.ipynb", "docs/b.md", "docs/nb.ipynb", "build/c.md", ".ipynb_checkpoints/nb.ipynb"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text("")
+    return tmp_path
+
+
+def test_walk_files(monkeypatch, tree):
+    scandir, scanned = os.scandir, []
     with monkeypatch.context() as m:
-        m.setattr(lib, "getoutput", lambda cmd: "\n".join(expected))
-        files = get_modified_nbs()
-        assert files == expected
+        m.setattr(lib.os, "scandir", lambda path: scanned.append(os.path.relpath(path, tree)) or scandir(path))
+        files = sorted(lib.walk_files(str(tree), exclude=["build", ".ipynb_checkpoints"]))
+    assert files == ["a.md", "docs/b.md", "docs/nb.ipynb", "nb.ipynb"]
+    # Excluded directories are not walked.
+    assert sorted(scanned) == [".", "docs"]
 
 
-def test_get_modified_mds(monkeypatch, make_tmp_md):
-    expected = [str(make_tmp_md(file)) for file in string.ascii_lowercase]
+@pytest.mark.parametrize("git", [True, False])
+def test_get_all_files(tree, git):
+    if git:
+        subprocess.run(["git", "init", "-q"], cwd=tree, check=True)
+        (tree / ".gitignore").write_text("build/\n")
+    files = lib.get_all_files((".ipynb", ".md"), root_dir=str(tree), exclude=[".ipynb_checkpoints"])
+    expected = ["a.md", "docs/b.md", "docs/nb.ipynb", "nb.ipynb"] + ([] if git else ["build/c.md"])
+    assert sorted(files) == sorted(expected)
+    assert sorted(lib.get_all_nbs(str(tree), include=["docs"])) == ["docs/nb.ipynb"]
+
+
+@pytest.fixture
+def badge_files(tmp_path):
+    """Files with and without badge tags / tracked badges."""
+    files = {
+        "a.md": "foo {{badge nb}}\n",
+        "b.md": "foo\nbar\n",
+        "c.md": "",
+        "d/e.ipynb": json.dumps({"cells": [{"cell_type": "markdown", "source": ["<!--<badge>--><!--</badge>-->"]}]}),
+        "d/f.ipynb": json.dumps({"cells": [{"cell_type": "markdown", "source": ["{{ bdg }}"]}]}),
+    }
+    for name, content in files.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(content)
+    return tmp_path, [*files], ["a.md", "d/e.ipynb"]
+
+
+def test_has_badge_markers(badge_files):
+    root, files, expected = badge_files
+    assert [file for file in files if lib.has_badge_markers(str(root / file))] == expected
+    assert lib.has_badge_markers(str(root / "missing.md")) is False
+
+
+def test_filter_badge_files_git(badge_files):
+    root, files, expected = badge_files
+    subprocess.run(["git", "init", "-q"], cwd=root, check=True)
+    assert lib.grep_badge_files(str(root)) == set(expected)
+    assert lib.filter_badge_files(files, root_dir=str(root)) == expected
+    # Only given paths are searched (literally, missing ones are skipped).
+    (root / "*.md").write_text("{{ badge }}\n")
+    assert lib.grep_badge_files(str(root), ["d/e.ipynb", "b.md", "missing.md"]) == {"d/e.ipynb"}
+    assert lib.grep_badge_files(str(root), ["*.md"]) == {"*.md"}
+
+
+def test_filter_badge_files_fallback(monkeypatch, badge_files):
+    root, files, expected = badge_files
     with monkeypatch.context() as m:
-        m.setattr(lib, "getoutput", lambda cmd: "\n".join(expected))
-        files = get_modified_mds()
-        assert files == expected
+        m.setattr(lib, "grep_badge_files", lambda root_dir, paths: None)
+        assert lib.filter_badge_files(files, root_dir=str(root)) == expected
+    # Not a git repository.
+    assert lib.grep_badge_files(str(root)) is None
 
 
 @pytest.mark.parametrize(
@@ -237,28 +617,505 @@ def test_append_ext_to_url(url, expected):
 
 def test_check_nb_link_ok(monkeypatch):
     with monkeypatch.context() as m:
-        m.setattr(lib.http.client.HTTPSConnection, "request", lambda *args: None)
-        m.setattr(
-            lib.http.client.HTTPSConnection, "getresponse", lambda _: Namespace(**{"status": 200, "reason": "OK"})
-        )
+        m.setattr(http.client.HTTPSConnection, "request", lambda *args: None)
+        m.setattr(http.client.HTTPSConnection, "getresponse", lambda _: make_response(200, "OK"))
         res = check_nb_link("/usr/repo/blob/main/nb.ipynb")
         assert res is None
 
 
 def test_check_nb_link_bad(monkeypatch):
     with monkeypatch.context() as m:
-        m.setattr(lib.http.client.HTTPSConnection, "request", lambda *args: None)
-        m.setattr(
-            lib.http.client.HTTPSConnection, "getresponse", lambda _: Namespace(**{"status": 404, "reason": "Err"})
-        )
+        m.setattr(http.client.HTTPSConnection, "request", lambda *args: None)
+        m.setattr(http.client.HTTPSConnection, "getresponse", lambda _: make_response(404, "Err"))
         res = check_nb_link("/usr/repo/blob/main/nb.ipynb")
         assert res == (404, "Err")
 
 
+class FakeConnection:
+    """Minimal stand-in for HTTPSConnection."""
+
+    created = []
+
+    def __init__(self, host, timeout=None):
+        self.host, self.sock, self.requests = host, object(), []
+        FakeConnection.created.append(self)
+
+    def request(self, method, url, body=None, headers=None):
+        self.requests.append((method, url))
+        self.headers = headers or {}
+
+    def getresponse(self):
+        if self.headers.get("If-None-Match") == '"etag"':
+            status, reason = 304, "Not Modified"
+        elif "missing" in self.requests[-1][1]:
+            status, reason = 404, "Not Found"
+        else:
+            status, reason = 200, "OK"
+        headers = {"ETag": '"etag"'}
+        return Namespace(**{"status": status, "reason": reason, "read": lambda: b"", "getheader": headers.get})
+
+    def close(self):
+        self.sock = None
+
+
+def test_check_nb_link_dedupe(monkeypatch, checked_links):
+    FakeConnection.created = []
+    with monkeypatch.context() as m:
+        m.setattr(http.client, "HTTPSConnection", FakeConnection)
+        links = ["/usr/repo/blob/main/nb.ipynb", "/usr/repo/blob/main/missing.ipynb"] * 3
+        results = [check_nb_link(link) for link in links]
+
+    assert results == [None, (404, "Not Found")] * 3
+    # A single keep-alive connection, each distinct link requested once.
+    assert len(FakeConnection.created) == 1
+    assert FakeConnection.created[0].requests == [("HEAD", link) for link in links[:2]]
+    assert checked_links == {links[0]: None, links[1]: (404, "Not Found")}
+
+
+def test_connection_pool_reconnect(monkeypatch):
+    class StaleConnection(FakeConnection):
+        def request(self, method, url, body=None, headers=None):
+            raise http.client.RemoteDisconnected("closed")
+
+    FakeConnection.created = []
+    pool = lib.ConnectionPool()
+    pool.idle["github.com"] = [StaleConnection("github.com")]
+    with monkeypatch.context() as m:
+        m.setattr(http.client, "HTTPSConnection", FakeConnection)
+        response = pool.request("HEAD", "github.com", "/usr/repo/blob/main/nb.ipynb")
+
+    assert response.status == 200
+    assert pool.idle["github.com"] == [FakeConnection.created[-1]]
+    pool.close()
+    assert pool.idle == {}
+
+
+def test_link_cache_save_load(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = lib.LinkCache(path=path)
+    cache.put("/usr/repo/blob/main/nb.ipynb", lib.CacheEntry(time=1.0, status=200, reason="OK", etag='"etag"'))
+    cache.save()
+
+    cache2 = lib.LinkCache(path=path)
+    cache2.load()
+    assert cache2.entries == cache.entries
+    assert cache.pop_updates() == cache.entries
+    assert cache.pop_updates() == {}
+
+
+@pytest.mark.parametrize("content", ["", "{", '{"version": 0, "links": {}}', '{"version": 1, "links": {"a": 1}}'])
+def test_link_cache_load_broken(tmp_path, content):
+    path = tmp_path / "cache.json"
+    path.write_text(content)
+    cache = lib.LinkCache(path=str(path))
+    cache.load()
+    assert cache.entries == {}
+
+
+@pytest.mark.parametrize("status, age, fresh", [(200, 100, True), (200, 1000, False), (404, 100, False)])
+def test_link_cache_is_fresh(status, age, fresh):
+    cache = lib.LinkCache(path="cache.json", ttl=500, negative_ttl=50)
+    entry = lib.CacheEntry(time=lib.time.time() - age, status=status, reason="")
+    assert cache.is_fresh(entry) is fresh
+
+
+def test_check_nb_link_cache(monkeypatch):
+    FakeConnection.created = []
+    cache = lib.LinkCache(path="cache.json", ttl=100)
+    link = "/usr/repo/blob/main/nb.ipynb"
+    with monkeypatch.context() as m:
+        m.setattr(http.client, "HTTPSConnection", FakeConnection)
+        m.setattr(lib, "link_cache", cache)
+        # Fresh entry, no requests.
+        cache.entries[link] = lib.CacheEntry(time=lib.time.time(), status=404, reason="Not Found")
+        assert check_nb_link(link) == (404, "Not Found")
+        assert FakeConnection.created == []
+        # Stale entry, revalidated with a conditional request.
+        lib.checked_links.clear()
+        lib.scheduler.futures.clear()
+        cache.entries[link] = lib.CacheEntry(time=0.0, status=200, reason="OK", etag='"etag"')
+        assert check_nb_link(link) is None
+        assert FakeConnection.created[0].headers == {"If-None-Match": '"etag"'}
+        assert cache.entries[link].status == 200
+        assert cache.entries[link].time > 0.0
+        # Unknown link.
+        link2 = "/usr/repo/blob/main/missing.ipynb"
+        assert check_nb_link(link2) == (404, "Not Found")
+        assert cache.pop_updates().keys() == {link, link2}
+
+
+def make_response(status, reason="", **headers):
+    return Namespace(**{"status": status, "reason": reason, "read": lambda: b"", "getheader": headers.get})
+
+
+@pytest.mark.parametrize(
+    "responses, expected, delays",
+    [
+        ([make_response(503), make_response(200, "OK")], None, [1]),
+        ([make_response(500), make_response(502), make_response(404, "Not Found")], (404, "Not Found"), [1, 2]),
+        ([make_response(429, **{"Retry-After": "7"}), make_response(200, "OK")], None, [7]),
+        # Transient failures after the retries: the link is not verified, the badge is not blocked.
+        ([make_response(403, **{"X-RateLimit-Remaining": "0"})] * 3, None, [1, 2]),
+        ([make_response(503, "Service Unavailable")] * 3, None, [1, 2]),
+        ([make_response(408, "Request Timeout")] * 3, None, [1, 2]),
+        # Not a rate limit, not retried.
+        ([make_response(403, "Forbidden")], (403, "Forbidden"), []),
+    ],
+)
+def test_remote_scheduler_retry(monkeypatch, responses, expected, delays):
+    delays_ = []
+    responses = [*responses]
+    scheduler = lib.RemoteScheduler(retries=2)
+    with monkeypatch.context() as m:
+        m.setattr(scheduler.pool, "request", lambda method, host, url, headers: responses.pop(0))
+        m.setattr(lib.time, "sleep", delays_.append)
+        assert scheduler.check("/usr/repo/blob/main/nb.ipynb") == expected
+    assert delays_ == delays
+
+
+def test_remote_scheduler_rate_limit(monkeypatch):
+    reset = int(lib.time.time()) + 30
+    scheduler = lib.RemoteScheduler()
+    response = make_response(200, "OK", **{"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)})
+    delays = []
+    with monkeypatch.context() as m:
+        m.setattr(scheduler.pool, "request", lambda method, host, url, headers: response)
+        m.setattr(lib.time, "sleep", delays.append)
+        assert scheduler.check("/usr/repo/blob/main/nb1.ipynb") is None
+        assert scheduler.paused_until == reset
+        # Next request waits for the reset.
+        assert scheduler.check("/usr/repo/blob/main/nb2.ipynb") is None
+    assert len(delays) == 1 and 0 < delays[0] <= 30
+
+
+def test_remote_scheduler_budget(monkeypatch):
+    event = lib.threading.Event()
+    scheduler = lib.RemoteScheduler(budget=0.05)
+    with monkeypatch.context() as m:
+        m.setattr(scheduler.pool, "request", lambda method, host, url, headers: event.wait(1) and make_response(200))
+        assert scheduler.check("/usr/repo/blob/main/nb.ipynb") is None
+        event.set()
+
+
+def test_remote_scheduler_concurrency(monkeypatch):
+    lock, active, peak = lib.threading.Lock(), [0], [0]
+
+    def request(method, host, url, headers):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        lib.time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return make_response(200, "OK")
+
+    scheduler = lib.RemoteScheduler(concurrency=3)
+    with monkeypatch.context() as m:
+        m.setattr(scheduler.pool, "request", request)
+        futures = [scheduler.submit(f"/usr/repo/blob/main/nb{i}.ipynb") for i in range(12)]
+        assert [future.result() for future in futures] == [None] * 12
+    assert peak[0] == 3
+
+
+def test_remote_scheduler_pickle():
+    scheduler = lib.RemoteScheduler(concurrency=2, timeout=5, budget=100, retries=1)
+    scheduler2 = pickle.loads(pickle.dumps(scheduler))
+    assert (scheduler2.concurrency, scheduler2.timeout, scheduler2.retries) == (2, 5, 1)
+    assert abs(scheduler2.deadline - scheduler.deadline) < 1
+
+
+@pytest.fixture
+def fake_github(monkeypatch):
+    """Local stand-in for github.com, remote links are checked against it."""
+
+    def start(**kwargs):
+        server = FakeGitHub(**kwargs).start()
+        servers.append(server)
+        scheduler = lib.RemoteScheduler(timeout=2, retries=2, backoff=0, host=server.host, api_host=server.host)
+        monkeypatch.setattr(lib, "scheduler", scheduler)
+        return server
+
+    servers = []
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_check_nb_link_fake_github(fake_github):
+    server = fake_github(statuses={"/usr/repo/blob/main/missing.ipynb": 404})
+    assert check_nb_link("/usr/repo/blob/main/nb.ipynb") is None
+    assert check_nb_link("/usr/repo/blob/main/missing.ipynb") == (404, "Not Found")
+    # Checked once, over the same (kept-alive) connection.
+    assert check_nb_link("/usr/repo/blob/main/nb.ipynb") is None
+    assert [request[:2] for request in server.requests] == [
+        ("HEAD", "/usr/repo/blob/main/nb.ipynb"),
+        ("HEAD", "/usr/repo/blob/main/missing.ipynb"),
+    ]
+    assert len(lib.scheduler.pool.idle[server.host]) == 1
+
+
+def test_prepare_path_remote_fake_github(fake_github, logger, line, file, badge, patterns):
+    fake_github(statuses={"/usr2/repo/blob/main/nb2.ipynb": 404})
+    _line, _file = line(data="{{ badge https://github.com/usr2/repo/blob/main/nb1 }}"), file(path="file.md")
+    match = patterns.combined.match(_line.data)
+    expected = badge.url2.safe_substitute(file="/usr2/repo/blob/main/nb1.ipynb")
+    assert prepare_path_remote_full(match, match["path"], _line, _file, badge, logger) == expected
+    assert prepare_path_remote(match, "/usr2/repo/blob/main/nb2", _line, _file, badge, logger) is None
+
+
+@pytest.mark.parametrize(
+    "kwargs, expected, requests",
+    [
+        # Transient errors are retried.
+        ({"statuses": {"/nb.ipynb": [503, 502, 200]}}, None, 3),
+        ({"statuses": {"/nb.ipynb": [503, 404]}}, (404, "Not Found"), 2),
+        ({"statuses": {"/nb.ipynb": 500}}, None, 3),
+        # Connection resets.
+        ({"resets": {"/nb.ipynb": 2}}, None, 3),
+        # Server is unreachable, badges are not blocked.
+        ({"resets": {"/nb.ipynb": True}}, None, 3),
+        # Rate limits.
+        ({"rate_limit": 0, "rate_window": 0.05, "retry_after": True}, None, 3),
+        ({"rate_limit": 0, "rate_window": 0.05}, None, 3),
+    ],
+)
+def test_remote_scheduler_fake_github(fake_github, kwargs, expected, requests):
+    server = fake_github(**kwargs)
+    assert lib.scheduler.check("/nb.ipynb") == expected
+    assert server.count("/nb.ipynb") == requests
+
+
+def test_remote_scheduler_unverified_fake_github(fake_github, caplog):
+    fake_github(statuses={"/nb.ipynb": 500}, resets={"/nb2.ipynb": True})
+    assert lib.scheduler.check("/nb.ipynb") is None
+    assert lib.scheduler.check("/nb2.ipynb") is None
+    # Transient failures are logged, the same way for any of them.
+    assert [record.getMessage() for record in caplog.records if record.levelname == "WARNING"] == [
+        "/nb.ipynb: Link is not verified (500 Internal Server Error), the badge is kept anyway",
+        "/nb2.ipynb: Link is not verified (0 Error), the badge is kept anyway",
+    ]
+
+
+def test_remote_scheduler_fake_github_latency(fake_github):
+    server = fake_github(latency=0.05)
+    lib.scheduler = lib.RemoteScheduler(concurrency=10, host=server.host)
+    start = lib.time.perf_counter()
+    futures = [lib.scheduler.submit(f"/usr/repo/blob/main/nb{i}.ipynb") for i in range(20)]
+    assert [future.result() for future in futures] == [None] * 20
+    # Requests are concurrent.
+    assert lib.time.perf_counter() - start < 0.05 * 20 / 2
+    # Slow server, no time left.
+    lib.scheduler = lib.RemoteScheduler(budget=0.01, host=server.host)
+    assert lib.scheduler.check("/usr/repo/blob/main/nb.ipynb") is None
+
+
+def test_link_cache_fake_github(fake_github, tmp_path, monkeypatch):
+    server = fake_github()
+    cache = lib.LinkCache(str(tmp_path / "cache.json"), ttl=0)
+    monkeypatch.setattr(lib, "link_cache", cache)
+    assert lib.scheduler.check("/usr/repo/blob/main/nb.ipynb") is None
+    # Stale entry is revalidated with ETag.
+    lib.scheduler.futures.clear()
+    assert lib.scheduler.check("/usr/repo/blob/main/nb.ipynb") is None
+    assert server.requests[1][2]["If-None-Match"] == cache.get("/usr/repo/blob/main/nb.ipynb").etag
+
+
+def test_find_locations(patterns):
+    lines = [
+        "foo {{ badge nb }} {{ badge //drive/0000 }}\n",
+        "bar\n",
+        "{{ badge }} <!--<badge>-->[![Open In Colab](x)](y)<!--</badge>-->\n",
+    ]
+    assert [*lib.find_locations(lines, patterns, 2)] == [
+        Location(2, 0, "nb"),
+        Location(2, 0, "//drive/0000"),
+        Location(2, 2, ""),
+        Location(2, 2, ""),
+    ]
+
+
+def test_scan_file(tmp_path, patterns):
+    (tmp_path / "a.md").write_text("{{ badge nb }}\n\n{{ badge //drive/0000 }}\n")
+    locations = lib.scan_file(str(tmp_path / "a.md"), patterns)
+    assert locations == [Location(None, 0, "nb"), Location(None, 2, "//drive/0000")]
+    # Only markdown cells are scanned (tags in code cells and outputs are not badges).
+    cells = [
+        {"cell_type": "code", "source": ["{{ badge code }}"], "outputs": [{"text": ["{{ badge output }}"]}]},
+        {"cell_type": "markdown", "source": ["foo\n", "{{ badge nb }}"]},
+    ]
+    (tmp_path / "b.ipynb").write_text(json.dumps({"cells": cells}))
+    for lazy in (False, True):
+        assert lib.scan_file(str(tmp_path / "b.ipynb"), patterns, lazy=lazy) == [Location(1, 1, "nb")]
+    assert lib.scan_file(str(tmp_path / "missing.md"), patterns) == []
+
+
+def test_resolve_files_prefetch(fake_github, tmp_path, file, badge, patterns, monkeypatch):
+    server = fake_github(trees={"usr2/repo/main": ["nb1.ipynb", "nb2.ipynb"]})
+    cells = [{"cell_type": "markdown", "source": ["{{ badge /usr2/repo/blob/main/nb1 }}"]}]
+    (tmp_path / "a.ipynb").write_text(json.dumps({"cells": cells}))
+    (tmp_path / "b.md").write_text("{{ badge /usr2/repo/blob/main/nb2 }}\n{{ badge /usr3/repo/blob/main/nb }}\n")
+    files = [file(path=str(tmp_path / "a.ipynb"), type="notebook"), file(path=str(tmp_path / "b.md"), type="md")]
+    submitted = []
+    monkeypatch.setattr(lib, "resolve_targets", lambda *args: submitted.extend(lib.scheduler.futures))
+    lib.resolve_files(files, badge, patterns, lazy=True)
+    # Checks are started by the scan: the first link of a ref, listing of the ref tree for the next ones.
+    assert sorted(submitted) == ["/usr2/repo/blob/main/nb1.ipynb", "/usr3/repo/blob/main/nb.ipynb"]
+    assert [*lib.scheduler.trees] == [("usr2", "repo", "main")]
+    lib.scheduler.shutdown()
+    assert server.count() == 3
+    # Notebooks with badges are not read again.
+    monkeypatch.setattr(lib, "read_file", None)
+    assert lib.process_file(files[0], badge, patterns, lazy=True).blob is not None
+    assert lib.parsed == {}
+
+
+def test_resolve_files(tmp_path, file, badge, patterns, monkeypatch):
+    (tmp_path / "a.md").write_text("{{ badge nb }}\n{{ badge }}\n")
+    (tmp_path / "b.md").write_text("{{ badge //drive/0000 }}\n{{ badge nb }}\n")
+    files = [file(path=str(tmp_path / "a.md"), type="md"), file(path=str(tmp_path / "b.md"), type="md")]
+    batches = []
+    monkeypatch.setattr(lib.LocalResolver, "resolve_many", lambda self, targets, f, b: batches.append(targets) or {})
+    lib.resolve_files(files, badge, patterns)
+    # Distinct targets of the files are resolved at once, locations are kept.
+    assert batches == [["nb"]]
+    assert lib.located[files[0].path] == [Location(None, 0, "nb"), Location(None, 1, "")]
+    assert lib.located[files[1].path] == [Location(None, 0, "//drive/0000"), Location(None, 1, "nb")]
+
+
+def test_check_trees_fake_github(fake_github, tmp_path, monkeypatch, file, badge):
+    trees = {
+        "usr2/repo/main": ["nb1.ipynb", "nbs/nb 2.ipynb", "README.md"],
+        "usr3/repo/dev": ["nb1.ipynb", "nb2.ipynb"],
+    }
+    server = fake_github(trees=trees)
+    monkeypatch.setattr(lib, "link_cache", lib.LinkCache(str(tmp_path / "cache.json")))
+    targets = [
+        "/usr2/repo/blob/main/nb1",
+        "https://github.com/usr2/repo/blob/main/nbs/nb%202.ipynb",
+        "/usr2/repo/blob/main/missing",
+        "/usr3/repo/blob/dev/nb1",
+        "/usr3/repo/blob/dev/nb2",
+        # Single notebook of a repo, not listed.
+        "/usr4/repo/blob/main/nb",
+        # Refs with slashes are not found, notebooks are checked one by one.
+        "/usr2/repo/blob/feature/x/nb1",
+        "/usr2/repo/blob/feature/x/nb2",
+    ]
+    lib.resolve_targets(targets, file(), badge)
+    assert sorted(request[1] for request in server.requests) == [
+        "/repos/usr2/repo/git/trees/feature?recursive=1",
+        "/repos/usr2/repo/git/trees/main?recursive=1",
+        "/repos/usr3/repo/git/trees/dev?recursive=1",
+        "/usr2/repo/blob/feature/x/nb1.ipynb",
+        "/usr2/repo/blob/feature/x/nb2.ipynb",
+        "/usr4/repo/blob/main/nb.ipynb",
+    ]
+    errors = {target for target in targets if lib.resolved[("usr/repo", "main", target)].url is None}
+    assert errors == {"/usr2/repo/blob/main/missing"}
+    # Results are cached.
+    assert lib.link_cache.get("/usr2/repo/blob/main/missing.ipynb").status == 404
+    assert lib.link_cache.get("/usr3/repo/blob/dev/nb2.ipynb").status == 200
+
+
+def test_check_trees_same_directory_fake_github(fake_github, tmp_path, monkeypatch, file, badge):
+    server = fake_github(trees={"usr2/repo/main": [f"notebooks/nb{i}.ipynb" for i in range(5)]})
+    monkeypatch.setattr(lib, "link_cache", lib.LinkCache(str(tmp_path / "cache.json")))
+    targets = [f"/usr2/repo/blob/main/notebooks/nb{i}" for i in range(6)]
+    lib.resolve_targets(targets, file(), badge)
+    # Notebooks of the same directory are checked with a single listing.
+    assert [request[1] for request in server.requests] == ["/repos/usr2/repo/git/trees/main?recursive=1"]
+    errors = {target for target in targets if lib.resolved[("usr/repo", "main", target)].url is None}
+    assert errors == {"/usr2/repo/blob/main/notebooks/nb5"}
+
+
+def test_fetch_tree_fake_github(fake_github):
+    statuses = {"/repos/usr/repo/git/trees/dev?recursive=1": 403}
+    server = fake_github(trees={"usr/repo/main": ["nb.ipynb"]}, statuses=statuses)
+    assert lib.scheduler.tree("usr", "repo", "main") == {"nb.ipynb"}
+    # Listed once per run.
+    assert lib.scheduler.tree("usr", "repo", "main") == {"nb.ipynb"}
+    assert server.count() == 1
+    # Not found, rate limited.
+    assert lib.scheduler.tree("usr", "repo", "other") is None
+    assert lib.scheduler.tree("usr", "repo", "dev") is None
+    # Disabled.
+    lib.scheduler.api_host = ""
+    assert lib.scheduler.tree("usr", "repo2", "main") is None
+    assert server.count() == 3
+    # No token, no authorization.
+    assert "Authorization" not in server.requests[0][2]
+
+
+def test_fetch_tree_token_fake_github(fake_github):
+    server = fake_github(trees={"usr/repo/main": ["nb.ipynb"]})
+    lib.scheduler.token = "secret"
+    assert lib.scheduler.tree("usr", "repo", "main") == {"nb.ipynb"}
+    assert server.requests[0][2]["Authorization"] == "Bearer secret"
+    assert pickle.loads(pickle.dumps(lib.scheduler)).token == "secret"
+
+
+@pytest.mark.parametrize(
+    "target, resolver",
+    [
+        ("nbs/nb", lib.LocalResolver),
+        ("nb.ipynb", lib.LocalResolver),
+        ("//drive/0000", lib.DriveResolver),
+        ("/usr2/repo/blob/main/nb", lib.GitHubResolver),
+        ("https://github.com/usr2/repo/blob/main/nb", lib.GitHubResolver),
+        ("HTTPS://example.com/usr2/repo/blob/main/nb", lib.GitHubResolver),
+        ("github.com/usr2/repo/blob/main/nb", lib.LocalResolver),
+    ],
+)
+def test_find_resolver(target, resolver):
+    assert type(lib.find_resolver(target)) is resolver
+
+
+def test_register_resolver(monkeypatch, line, file, badge, patterns, logger):
+    class GistResolver(lib.Resolver):
+        def match(self, target):
+            return target.startswith("https://gist.github.com/")
+
+        def resolve_many(self, targets, file, badge):
+            batches.append(sorted(targets))
+            return {target: lib.Resolution(target.replace("gist.github.com", "colab/gist")) for target in targets}
+
+    batches = []
+    monkeypatch.setattr(lib, "resolvers", [*lib.resolvers])
+    lib.register_resolver(GistResolver())
+    targets = ["https://gist.github.com/usr/1", "https://gist.github.com/usr/2", "//drive/0000"]
+    lib.resolve_targets(targets + targets, file(), badge)
+    # One batch per resolver.
+    assert batches == [["https://gist.github.com/usr/1", "https://gist.github.com/usr/2"]]
+    _line = line(data="{{ badge https://gist.github.com/usr/2 }}")
+    new_line = check_md_line(line=_line, file=file(), badge=badge, patterns=patterns, logger=logger)
+    assert new_line.data == badge.md.safe_substitute(url="https://colab/gist/usr/2")
+
+
+def test_resolve_targets_fake_github(fake_github, file, badge, patterns):
+    server = fake_github(latency=0.05, statuses={"/usr2/repo/blob/main/missing.ipynb": 404})
+    lib.scheduler = lib.RemoteScheduler(concurrency=10, host=server.host, api_host="")
+    _file = file(path="file.md")
+    targets = [f"/usr2/repo/blob/main/nb{i}" for i in range(10)] + ["/usr2/repo/blob/main/missing", "//drive/0000"]
+    start = lib.time.perf_counter()
+    lib.resolve_targets(targets + targets, _file, badge)
+    # Distinct targets are checked once, concurrently.
+    assert lib.time.perf_counter() - start < 0.05 * 10 / 2
+    assert server.count() == 11
+    assert lib.resolved[("usr/repo", "main", "/usr2/repo/blob/main/nb0")].url == badge.url2.safe_substitute(
+        file="/usr2/repo/blob/main/nb0.ipynb"
+    )
+    missing = lib.resolved[("usr/repo", "main", "/usr2/repo/blob/main/missing")]
+    assert missing == lib.Resolution(None, "404 Not Found", "Specified file /usr2/repo/blob/main/missing Not Found.")
+    assert lib.resolved[("usr/repo", "main", "//drive/0000")].url == "https://colab.research.google.com/drive/0000"
+    # Resolved already.
+    lib.resolve_targets(targets, _file, badge)
+    assert server.count() == 11
+
+
 @pytest.mark.parametrize("path, track", [("nb1.md", True), ("nb2.md", False)])
 def test_prepare_path_self_none(caplog, logger, line, file, badge, patterns, path, track):
     line, file = line(), file(path=path, type="md", track=track)
-    match = patterns.badge.match(line.data)
+    match = patterns.combined.match(line.data)
     line_num = str(line.num)
     title = ":".join((file.path, line_num, " " + "Incorrect {{ badge }} usage."))
     level = "ERROR"
@@ -280,7 +1137,7 @@ def test_prepare_path_self_none(caplog, logger, line, file, badge, patterns, pat
 @pytest.mark.parametrize("path, track", [("nb1.md", True), ("nb2.md", False)])
 def test_prepare_path_self_error(logger, line, file, badge, patterns, path, track):
     line, file = line(), file(path=path, type="py", track=track)
-    match = patterns.badge.match(line.data)
+    match = patterns.combined.match(line.data)
 
     with pytest.raises(ValueError):
         nb_path = prepare_path_self(match, line, file, badge, logger)
@@ -290,7 +1147,7 @@ def test_prepare_path_self_error(logger, line, file, badge, patterns, path, trac
 @pytest.mark.parametrize("path, track", [("nb.ipynb", True), ("nb.ipynb", False)])
 def test_prepare_path_self(logger, line, file, badge, patterns, path, track):
     line, file = line(), file(path=path, type="notebook", track=track)
-    match = patterns.badge.match(line.data)
+    match = patterns.combined.match(line.data)
 
     expected = badge.url.safe_substitute(repo=file.repo, branch=file.branch, file=file.path)
     nb_path = prepare_path_self(match, line, file, badge, logger)
@@ -308,7 +1165,7 @@ def test_prepare_path_self(logger, line, file, badge, patterns, path, track):
 )
 def test_prepare_path_local_none(caplog, logger, line, file, badge, patterns, path, nb_path, type):
     line, file = line(data="{{ " + f"badge {nb_path}" + " }}"), file(path=path, type=type)
-    match = patterns.badge.match(line.data)
+    match = patterns.combined.match(line.data)
     line_num = str(line.num)
     title = ":".join((file.path, line_num, " " + "File doesn't exist."))
     level = "ERROR"
@@ -336,13 +1193,65 @@ def test_prepare_path_local_none(caplog, logger, line, file, badge, patterns, pa
 def test_prepare_path_local(logger, make_tmp_nb, line, file, badge, patterns, path, nb_path, type):
     tmp_nb = make_tmp_nb(nb_path)
     line, file = line(data="{{ " + f"badge {tmp_nb}" + " }}"), file(path=path, type=type)
-    match = patterns.badge.match(line.data)
+    match = patterns.combined.match(line.data)
     expected = badge.url.safe_substitute(repo=file.repo, branch=file.branch, file=tmp_nb)
 
     path = prepare_path_local(match, tmp_nb, line, file, badge, logger)
     assert path == expected
 
 
+def test_notebook_index():
+    index = lib.NotebookIndex(["nbs/a.ipynb", "./nbs/b.ipynb", "docs/nbs/a.ipynb", "other/intro.ipynb"])
+    assert len(index) == 4
+    assert "nbs/a.ipynb" in index
+    assert "./nbs//b.ipynb" in index
+    assert "nbs/c.ipynb" not in index
+    # Moved notebooks (same name), then similar names from the same directory.
+    assert index.suggest("a.ipynb") == ["docs/nbs/a.ipynb", "nbs/a.ipynb"]
+    assert index.suggest("nbs/bb.ipynb") == ["nbs/b.ipynb"]
+    assert index.suggest("nbs/zzz.ipynb") == []
+    assert lib.NotebookIndex().suggest("a.ipynb") == []
+
+
+def test_prepare_path_local_index(caplog, monkeypatch, logger, line, file, badge, patterns):
+    monkeypatch.setattr(lib, "nb_index", lib.NotebookIndex(["nbs/intro.ipynb"]))
+    _file = file(path="file.md", type="md")
+    # Index only, no file system checks.
+    nb_line = line(data="{{ badge nbs/intro }}")
+    path = prepare_path_local(patterns.combined.match(nb_line.data), "nbs/intro", nb_line, _file, badge, logger)
+    assert path == badge.url.safe_substitute(repo=_file.repo, branch=_file.branch, file="nbs/intro.ipynb")
+
+    nb_line = line(data="{{ badge intro }}")
+    with caplog.at_level(logging.ERROR):
+        path = prepare_path_local(patterns.combined.match(nb_line.data), "intro", nb_line, _file, badge, logger)
+    assert path is None
+    assert caplog.records[-1].message == (
+        "Specified file intro doesn't exist in current repository. Did you mean nbs/intro.ipynb?"
+    )
+
+
+def test_setup_nb_index(monkeypatch):
+    index = lib.setup_nb_index(iter(["a.ipynb"]))
+    assert lib.nb_index is index and "a.ipynb" in index
+
+
+def test_setup_nb_index_loader(monkeypatch):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return ["nbs/a.ipynb"]
+
+    # Notebooks are listed on the first check only.
+    index = lib.setup_nb_index(loader=loader)
+    assert calls == []
+    assert "nbs/a.ipynb" in index and "nbs/b.ipynb" not in index
+    assert calls == [1]
+    # Workers get the loaded index.
+    index = lib.setup_nb_index(loader=lambda: ["nbs/c.ipynb"])
+    assert pickle.loads(pickle.dumps(index)).paths == {"nbs/c.ipynb"}
+
+
 @pytest.mark.parametrize(
     "path, nb_path",
     [
@@ -354,7 +1263,7 @@ def test_prepare_path_local(logger, make_tmp_nb, line, file, badge, patterns, pa
 )
 def test_prepare_path_remote_none(caplog, logger, monkeypatch, line, file, badge, patterns, path, nb_path):
     _line, _file = line(data="{{ " + f"badge {nb_path}" + " }}"), file(path=path)
-    match = patterns.badge.match(_line.data)
+    match = patterns.combined.match(_line.data)
 
     with monkeypatch.context() as m:
         status, reason = (404, "Not Found")
@@ -386,7 +1295,7 @@ def test_prepare_path_remote_none(caplog, logger, monkeypatch, line, file, badge
 )
 def test_prepare_path_remote(logger, monkeypatch, line, file, badge, patterns, path, nb_path, exp_nb_path):
     _line, _file = line(data="{{ " + f"badge {nb_path}" + " }}"), file(path=path)
-    match = patterns.badge.match(_line.data)
+    match = patterns.combined.match(_line.data)
 
     with monkeypatch.context() as m:
         m.setattr(lib, "check_nb_link", lambda nb: None)
@@ -407,7 +1316,7 @@ def test_prepare_path_remote(logger, monkeypatch, line, file, badge, patterns, p
 )
 def test_prepare_path_remote_full_none(caplog, logger, line, file, badge, patterns, path, nb_path):
     _line, _file = line(data="{{ " + f"badge {nb_path}" + " }}"), file(path=path)
-    match = patterns.badge.match(_line.data)
+    match = patterns.combined.match(_line.data)
 
     line_num = str(_line.num)
     title = ":".join((_file.path, line_num, " " + "Wrong hostname."))
@@ -436,9 +1345,9 @@ def test_prepare_path_remote_full_none(caplog, logger, line, file, badge, patter
 )
 def test_prepare_path_remote_full_none_none(logger, monkeypatch, line, file, badge, patterns, path, nb_path):
     _line, _file = line(data="{{ " + f"badge {nb_path}" + " }}"), file(path=path)
-    match = patterns.badge.match(_line.data)
+    match = patterns.combined.match(_line.data)
     with monkeypatch.context() as m:
-        m.setattr(lib, "prepare_path_remote", lambda match, nb_path, line, file, badge, logger: None)
+        m.setattr(lib, "resolve_remote", lambda nb_path, badge: lib.Resolution(None, "404 Not Found", "Not found."))
         path = prepare_path_remote_full(match, nb_path, _line, _file, badge, logger)
         assert path is None
 
@@ -462,13 +1371,13 @@ def test_prepare_path_remote_full_none_none(logger, monkeypatch, line, file, bad
 )
 def test_prepare_path_remote_full(logger, monkeypatch, line, file, badge, patterns, path, nb_path, exp_nb_path):
     _line, _file = line(data="{{ " + f"badge {nb_path}" + " }}"), file(path=path)
-    match = patterns.badge.match(_line.data)
+    match = patterns.combined.match(_line.data)
     with monkeypatch.context() as m:
         m.setattr(
             lib,
-            "prepare_path_remote",
-            lambda match, nb_path, line, file, badge, logger: badge.url2.safe_substitute(
-                file=nb_path.lstrip("https://github.com")
+            "resolve_remote",
+            lambda nb_path, badge: lib.Resolution(
+                badge.url2.safe_substitute(file=nb_path.lstrip("https://github.com"))
             ),
         )
         expected = badge.url2.safe_substitute(file=exp_nb_path.lstrip("https://github.com"))
@@ -481,12 +1390,6 @@ def test_prepare_path_drive(badge, nb_path):
     assert prepare_path_drive(nb_path, badge) == badge.drive.safe_substitute(file=nb_path.lstrip("//drive/"))
 
 
-@pytest.mark.parametrize("data", ["foo bar", "badge", "{{ bdg }}", "{{ badg }}"])
-def test_add_badge_none(logger, line, file, badge, patterns, data):
-    line = add_badge(line=line(data=data), file=file(), badge=badge, patterns=patterns, logger=logger)
-    assert line is None
-
-
 @pytest.mark.parametrize(
     "data, path, type, track, expected",
     [
@@ -512,12 +1415,12 @@ def test_add_badge_none(logger, line, file, badge, patterns, data):
         ("{{ badge }}", "nb.md", "md", True, None),
     ],
 )
-def test_add_badge_self(logger, line, file, badge, patterns, data, path, type, track, expected):
+def test_check_md_line_self(logger, line, file, badge, patterns, data, path, type, track, expected):
     _line = line(data=data)
     _file = file(path=path, type=type, track=track)
     expected = line(data=expected) if expected else None
 
-    new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+    new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
     assert new_line == expected
 
 
@@ -529,7 +1432,7 @@ def test_add_badge_self(logger, line, file, badge, patterns, data, path, type, t
         ("{{   badge     nbs/nb.ipynb }}", " nbs/nb.ipynb"),
     ],
 )
-def test_add_badge_local(logger, monkeypatch, line, file, badge, patterns, data, nb_path):
+def test_check_md_line_local(logger, monkeypatch, line, file, badge, patterns, data, nb_path):
     nb_path = append_ext_to_str(nb_path)
     url = f"https://colab.research.google.com/github/usr/repo/blob/main/{nb_path}"
     _line = line(data=data)
@@ -537,8 +1440,8 @@ def test_add_badge_local(logger, monkeypatch, line, file, badge, patterns, data,
     expected = line(data=f"[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]({url})")
 
     with monkeypatch.context() as m:
-        m.setattr(lib, "prepare_path_local", lambda match, nb_path, line, file, badge, logger: url)
-        new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+        m.setattr(lib, "resolve_local", lambda nb_path, file, badge: lib.Resolution(url))
+        new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
         assert new_line == expected
 
 
@@ -546,12 +1449,12 @@ def test_add_badge_local(logger, monkeypatch, line, file, badge, patterns, data,
     "data, nb_path",
     [("{{ badge //drive/0000 }}", "//drive/0000"), ("{{ badge                 //drive/1111   }}", "//drive/1111")],
 )
-def test_add_badge_drive(logger, line, file, badge, patterns, data, nb_path):
+def test_check_md_line_drive(logger, line, file, badge, patterns, data, nb_path):
     url = f"https://colab.research.google.com/drive/{nb_path.lstrip('//drive/')}"
     _line = line(data=data)
     _file = file()
     expected = line(data=f"[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]({url})")
-    new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+    new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
     assert new_line == expected
 
 
@@ -563,13 +1466,13 @@ def test_add_badge_drive(logger, line, file, badge, patterns, data, nb_path):
         "{{   badge   /usr2/repo2/blob/dev/nbs/nb.ipynb }}",
     ],
 )
-def test_add_badge_remote_none(logger, monkeypatch, line, file, badge, patterns, data):
+def test_check_md_line_remote_none(logger, monkeypatch, line, file, badge, patterns, data):
     _line = line(data=data)
     _file = file()
 
     with monkeypatch.context() as m:
-        m.setattr(lib, "prepare_path_remote", lambda match, nb_path, line, file, badge, logger: None)
-        new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+        m.setattr(lib, "resolve_remote", lambda nb_path, badge: lib.Resolution(None, "404 Not Found", "Not found."))
+        new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
         assert new_line is None
 
 
@@ -581,7 +1484,7 @@ def test_add_badge_remote_none(logger, monkeypatch, line, file, badge, patterns,
         ("{{   badge     /usr2/repo2/blob/dev/nbs/nb.ipynb }}", "/usr2/repo2/blob/dev/nbs/nb.ipynb"),
     ],
 )
-def test_add_badge_remote(logger, monkeypatch, line, file, badge, patterns, data, nb_path):
+def test_check_md_line_remote(logger, monkeypatch, line, file, badge, patterns, data, nb_path):
     nb_path = append_ext_to_str(nb_path)
     url = f"https://colab.research.google.com/github/{nb_path}"
     _line = line(data=data)
@@ -589,8 +1492,8 @@ def test_add_badge_remote(logger, monkeypatch, line, file, badge, patterns, data
     expected = line(data=f"[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]({url})")
 
     with monkeypatch.context() as m:
-        m.setattr(lib, "prepare_path_remote", lambda match, nb_path, line, file, badge, logger: url)
-        new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+        m.setattr(lib, "resolve_remote", lambda nb_path, badge: lib.Resolution(url))
+        new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
         assert new_line == expected
 
 
@@ -602,13 +1505,13 @@ def test_add_badge_remote(logger, monkeypatch, line, file, badge, patterns, data
         "{{   badge   https://github.com/usr2/repo2/blob/dev/nbs/nb.ipynb }}",
     ],
 )
-def test_add_badge_remote_full_none(logger, monkeypatch, line, file, badge, patterns, data):
+def test_check_md_line_remote_full_none(logger, monkeypatch, line, file, badge, patterns, data):
     _line = line(data=data)
     _file = file()
 
     with monkeypatch.context() as m:
-        m.setattr(lib, "prepare_path_remote_full", lambda match, nb_path, line, file, badge, logger: None)
-        new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+        m.setattr(lib, "resolve_remote_full", lambda nb_path, badge: lib.Resolution(None, "Wrong hostname.", "Wrong."))
+        new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
         assert new_line is None
 
 
@@ -626,7 +1529,7 @@ def test_add_badge_remote_full_none(logger, monkeypatch, line, file, badge, patt
         ),
     ],
 )
-def test_add_badge_remote_full(logger, monkeypatch, line, file, badge, patterns, data, nb_path):
+def test_check_md_line_remote_full(logger, monkeypatch, line, file, badge, patterns, data, nb_path):
     nb_path = append_ext_to_url(nb_path)
     url = f"https://colab.research.google.com/github/{nb_path.replace('https://github.com/', '')}"
     _line = line(data=data)
@@ -634,18 +1537,24 @@ def test_add_badge_remote_full(logger, monkeypatch, line, file, badge, patterns,
     expected = line(data=f"[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]({url})")
 
     with monkeypatch.context() as m:
-        m.setattr(lib, "prepare_path_remote_full", lambda match, nb_path, line, file, badge, logger: url)
-        new_line = add_badge(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
+        m.setattr(lib, "resolve_remote_full", lambda nb_path, badge: lib.Resolution(url))
+        new_line = check_md_line(line=_line, file=_file, badge=badge, patterns=patterns, logger=logger)
         assert new_line == expected
 
 
-def test_update_badge_none(line, file, badge, patterns):
-    line = update_badge(line=line(data="foo bar"), file=file(), badge=badge, patterns=patterns)
-    assert line is None
+def test_check_md_line_resolved_once(monkeypatch, logger, line, file, badge, patterns):
+    calls = []
+    resolve_target = lib.resolve_target
+    monkeypatch.setattr(lib, "resolve_target", lambda *args: calls.append(args[0]) or resolve_target(*args))
+    # Targets missed by the scan are resolved once (errors as well).
+    for _ in range(2):
+        for data in ("{{ badge //drive/0000 }}", "{{ badge missing }}"):
+            check_md_line(line=line(data=data), file=file(), badge=badge, patterns=patterns, logger=logger)
+    assert calls == ["//drive/0000", "missing"]
 
 
 @pytest.mark.parametrize("path, new_path", [("nb.ipynb", "nb2.ipynb"), ("nb.ipynb", "dir/nb.ipynb")])
-def test_update_badge(line, file, badge, patterns, path, new_path):
+def test_check_md_line_tracked(logger, line, file, badge, patterns, path, new_path):
     _line = line(
         data="<!--<badge>-->"
         f'<a href="https://colab.research.google.com/github/usr/repo/blob/main/{path}" target="_parent">'
@@ -658,16 +1567,19 @@ def test_update_badge(line, file, badge, patterns, path, new_path):
         '<img src="https://colab.research.google.com/assets/colab-badge.svg" alt="Open In Colab"/></a>'
         "<!--</badge>-->"
     )
-    line2 = update_badge(
+    line2 = check_md_line(
         line=_line,
         file=file(path=new_path),
         badge=badge,
         patterns=patterns,
+        logger=logger,
     )
     assert line2 == expected
 
 
-@pytest.mark.parametrize("data", ["", "{badge}", "{ badge }", "{{ badge }", "{{  }}", "badge"])
+@pytest.mark.parametrize(
+    "data", ["", "foo bar", "{badge}", "{ badge }", "{{ badge }", "{{  }}", "badge", "{{ bdg }}", "{{ badg }}"]
+)
 def test_check_md_line_none(logger, line, file, badge, patterns, data):
     _line = line(data=data)
     for track in (True, False):
@@ -675,14 +1587,23 @@ def test_check_md_line_none(logger, line, file, badge, patterns, data):
         assert line2 is None
 
 
-def test_check_md_line(logger, monkeypatch, line, file, badge, patterns):
-    _line = line(data="foo.bar")
-    for track in (True, False):
-        with monkeypatch.context() as m:
-            m.setattr(lib, "update_badge", lambda line, file, badge, patterns: _line)
-            m.setattr(lib, "add_badge", lambda line, file, badge, patterns, logger: _line)
-            line2 = check_md_line(line=_line, file=file(track=track), badge=badge, patterns=patterns, logger=logger)
-            assert line2 == _line
+@pytest.mark.parametrize("track", [True, False])
+def test_check_md_line(logger, line, file, badge, patterns, track):
+    tracked = badge.html.safe_substitute(url="https://colab.research.google.com/github/usr/repo/blob/main/old.ipynb")
+    data = f"foo {tracked} {{{{ badge //drive/0000 }}}} bar {{{{ badge }}}}\n"
+    _file = file(path="nbs/nb.ipynb", track=track)
+
+    # Tracked badges are updated (if tracking), badge tags are replaced, in a single pass.
+    self_url = lib.get_self_url(_file, badge)[1]
+    drive = check_md_line(line(data="{{ badge //drive/0000 }}"), _file, badge, patterns, logger).data
+    new_tracked = badge.html.safe_substitute(url=self_url) if track else tracked
+    self_badge = (badge.html if track else badge.md).safe_substitute(url=self_url)
+    expected = line(data=f"foo {new_tracked} {drive} bar {self_badge}\n")
+
+    line2 = check_md_line(line=line(data=data), file=_file, badge=badge, patterns=patterns, logger=logger)
+    assert line2 == expected
+    assert ("old.ipynb" in line2.data) is not track
+    assert "{{" not in line2.data
 
 
 def test_check_cell_none(logger, file, badge, patterns):
@@ -694,7 +1615,7 @@ def test_check_cell_none(logger, file, badge, patterns):
 def test_check_cell(logger, monkeypatch, line, file, badge, patterns):
     _line = line
     _text = ["foo", "bar", "foo", "bar"]
-    text = ["foo", "bar", "foo", "bar"]
+    text = ["{{ badge foo }}", "{{ badge bar }}", "{{ badge foo }}", "{{ badge bar }}"]
     cell = {"source": text}
     with monkeypatch.context() as m:
         m.setattr(lib, "check_md_line", lambda line, file, badge, patterns, logger: _line(data=_text.pop(0)))
@@ -711,13 +1632,37 @@ def test_check_md_none(logger, file, badge, patterns):
 def test_check_md(logger, monkeypatch, line, file, badge, patterns):
     _line = line
     _text = ["foo", "bar", "foo", "bar"]
-    text = ["foo", "bar", "foo", "bar"]
+    text = ["{{ badge foo }}", "{{ badge bar }}", "{{ badge foo }}", "{{ badge bar }}"]
     with monkeypatch.context() as m:
         m.setattr(lib, "check_md_line", lambda line, file, badge, patterns, logger: _line(data=_text.pop(0)))
         text2 = check_md(text=text, file=file(), badge=badge, patterns=patterns, logger=logger)
         assert text2 == text
 
 
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (["foo\n", "bar\n"], []),
+        (
+            ["{{ badge }}\n", "foo\n", "a {{ badge nb }} b {{ badge nb2 }}\n", "<!--<badge>--><!--</badge>-->"],
+            [0, 2, 3],
+        ),
+        (["{{\n", "badge }}\n", "{{ badge }}"], [2]),
+        ([], []),
+    ],
+)
+def test_find_lines(patterns, text, expected):
+    assert lib.find_lines(text, patterns) == expected
+
+
+def test_check_md_line_num(caplog, logger, file, badge, patterns):
+    text = ["foo\n", "\n", "{{ badge missing }}\n", "bar\n"]
+    _file = file(path="file.md", type="md")
+    with caplog.at_level(logging.ERROR):
+        assert check_md(text=text, file=_file, badge=badge, patterns=patterns, logger=logger) is None
+        assert [record.line for record in caplog.records] == ["3"]
+
+
 def test_check_cells_none(logger, file, badge, patterns):
     cells = [
         {"source": ["foo\n", "{{ foo }}"], "cell_type": "markdown"},
@@ -743,3 +1688,203 @@ def test_check_cells(logger, monkeypatch, file, badge, patterns):
         m.setattr(lib, "check_cell", lambda cell, file, badge, patterns, logger: _cells.pop(0))
         cells2 = check_cells(cells=cells, file=file(), badge=badge, patterns=patterns, logger=logger)
         assert cells2 == cells
+
+
+@pytest.mark.parametrize(
+    "value, expected", [("1", 1), ("4", 4), ("auto", os.cpu_count() or 1), ("", os.cpu_count() or 1)]
+)
+def test_get_workers(value, expected):
+    assert get_workers(value) == expected
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "many", "1.5"])
+def test_get_workers_error(value):
+    with pytest.raises(ValueError):
+        get_workers(value)
+
+
+def test_process_file(tmp_path, file, badge, patterns):
+    file_path = tmp_path / "file.md"
+    file_path.write_text("foo\n{{ badge //drive/0000 }}\n")
+    records, _, blob, _ = process_file(file(path=str(file_path), type="md"), badge, patterns, verbose=True)
+    assert file_path.read_text() == (
+        "foo\n"
+        "[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]"
+        "(https://colab.research.google.com/drive/0000)\n"
+    )
+    assert [record.getMessage() for record in records] == [f"{file_path}: Reading...", f"{file_path} Saving..."]
+    assert blob == lib.git_blob_id(str(file_path))
+
+
+def test_check_md_stream(tmp_path, logger, file, badge, patterns):
+    file_path = tmp_path / "file.md"
+    text = ["foo\n", "{{ badge //drive/0000 }} {{ badge missing }}\n", "bar"]
+    file_path.write_text("".join(text))
+    file_path.chmod(0o640)
+    _file = file(path=str(file_path), type="md")
+    assert lib.check_md_stream(str(file_path), _file, badge, patterns, logger)
+    assert file_path.read_text() == "".join(check_md(text, _file, badge, patterns, logger) or [])
+    assert file_path.stat().st_mode & 0o777 == 0o640
+    # Not modified, the original file is kept.
+    mtime = file_path.stat().st_mtime_ns
+    assert not lib.check_md_stream(str(file_path), _file, badge, patterns, logger)
+    assert file_path.stat().st_mtime_ns == mtime
+    assert [*tmp_path.iterdir()] == [file_path]
+
+
+def test_process_file_stream(tmp_path, monkeypatch, file, badge, patterns):
+    import tracemalloc
+
+    monkeypatch.setattr(lib, "md_stream_size", 2**20)
+    file_path = tmp_path / "file.md"
+    with open(file_path, "w") as f:
+        f.writelines(f"Line {i} of a large generated catalog.\n" for i in range(100_000))
+        f.write("{{ badge //drive/0000 }}\n")
+    size = file_path.stat().st_size
+    tracemalloc.start()
+    try:
+        records, _, blob, _ = process_file(file(path=str(file_path), type="md"), badge, patterns, verbose=True)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # Bounded memory, the file is not loaded as a whole.
+    assert peak < size / 4
+    assert [record.getMessage() for record in records] == [f"{file_path}: Reading...", f"{file_path} Saving..."]
+    assert blob == lib.git_blob_id(str(file_path))
+    with open(file_path) as f:
+        assert f.readlines()[-1] == badge.md.safe_substitute(url="https://colab.research.google.com/drive/0000") + "\n"
+
+
+def test_process_file_none(make_tmp_nb, file, badge, patterns):
+    nb = make_tmp_nb("nb")
+    mtime = nb.stat().st_mtime_ns
+    records, _, blob, _ = process_file(file(path=str(nb)), badge, patterns, verbose=False)
+    assert records == []
+    assert blob is None
+    assert nb.stat().st_mtime_ns == mtime
+
+
+def test_stats(monkeypatch):
+    stats = lib.setup_stats(True)
+    assert lib.stats is stats
+    lib.count("files_read")
+    lib.count("bytes_read", 10)
+    with lib.span("read"):
+        pass
+    assert stats.counters == {"files_read": 1, "bytes_read": 10}
+    report = stats.pop()
+    assert stats.counters == {} and stats.timings == {}
+    stats.merge(report)
+    stats.merge(report)
+    assert stats.report()["counters"] == {"files_read": 2, "bytes_read": 20}
+    assert [*stats.report()["timings"]] == ["read"]
+    assert stats.to_markdown().splitlines()[-2:] == ["| files_read | 2 |", "| bytes_read | 20 |"]
+    # Disabled.
+    assert lib.setup_stats(False) is None
+    lib.count("files_read")
+    with lib.span("read"):
+        pass
+
+
+def test_profile_run(tmp_path, file, badge, patterns):
+    md = tmp_path / "file.md"
+    md.write_text("{{ badge //drive/0000 }}\n" * 1000)
+    with lib.profile_run(str(tmp_path / "profile")):
+        process_file(file(path=str(md), type="md"), badge, patterns)
+    assert lib.memory_peaks is None
+    assert sorted(os.listdir(tmp_path / "profile")) == ["cpu.pstats", "cpu.txt", "memory.txt"]
+    assert "process_file" in (tmp_path / "profile" / "cpu.txt").read_text()
+    memory = (tmp_path / "profile" / "memory.txt").read_text()
+    assert memory.startswith("Peak: ")
+    assert f"{md}: " in memory
+    # Disabled.
+    with lib.profile_run(""):
+        assert lib.memory_peaks is None
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("stream", [False, True])
+def test_process_files_stats(tmp_path, monkeypatch, file, badge, patterns, workers, stream):
+    if stream:
+        monkeypatch.setattr(lib, "md_stream_size", 0)
+    stats = lib.setup_stats(True)
+    files = []
+    for name in "abcd":
+        file_path = tmp_path / f"{name}.md"
+        file_path.write_text("foo\n{{ badge //drive/0000 }} {{ badge //drive/0001 }}\n")
+        files.append(file(path=str(file_path), type="md"))
+    for result in process_files(files, badge, patterns, workers=workers):
+        stats.merge(result.stats)
+    counters = stats.report()["counters"]
+    assert counters["files_read"] == counters["files_written"] == 4
+    assert counters["badges_added"] == 8
+    assert counters["lines_scanned"] == 8
+    assert counters["bytes_read"] == 4 * len("foo\n{{ badge //drive/0000 }} {{ badge //drive/0001 }}\n")
+    assert counters["bytes_written"] == sum(os.path.getsize(f.path) for f in files)
+    # Streamed files are read and written while checked.
+    assert ({"check"} if stream else {"read", "check", "write"}) <= set(stats.timings)
+
+
+def test_local_stats(tmp_path, file, badge, patterns):
+    stats = lib.setup_stats(True)
+    lib.count("files_discovered", 2)
+    file_path = tmp_path / "a.md"
+    file_path.write_text("{{ badge //drive/0000 }}\n")
+    result = process_file(file(path=str(file_path), type="md"), badge, patterns)
+    # Stats of the file are returned, the global ones are kept as is.
+    assert result.stats["counters"]["files_read"] == 1
+    assert stats.counters == {"files_discovered": 2}
+    assert lib.stats is stats
+    with lib.local_stats() as local:
+        lib.count("targets")
+    assert local.counters == {"targets": 1}
+    lib.setup_stats(False)
+    with lib.local_stats() as local:
+        lib.count("targets")
+    assert local is None
+
+
+def test_remote_scheduler_stats(fake_github, tmp_path, monkeypatch):
+    stats = lib.setup_stats(True)
+    fake_github(statuses={"/nb.ipynb": [503, 200]})
+    monkeypatch.setattr(lib, "link_cache", lib.LinkCache(str(tmp_path / "cache.json")))
+    assert lib.scheduler.check("/nb.ipynb") is None
+    lib.scheduler.futures.clear()
+    assert lib.scheduler.check("/nb.ipynb") is None
+    assert stats.counters == {"remote_checks": 2, "cache_misses": 1, "remote_requests": 2, "cache_hits": 1}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_files_resolve(fake_github, tmp_path, file, badge, patterns, workers):
+    server = fake_github(trees={"usr2/repo/main": ["nb.ipynb"]})
+    files = []
+    for name in "abcd":
+        file_path = tmp_path / f"{name}.md"
+        file_path.write_text("{{ badge /usr2/repo/blob/main/nb }}\n{{ badge /usr2/repo/blob/main/missing }}\n")
+        files.append(file(path=str(file_path), type="md"))
+    results = [*process_files(files, badge, patterns, workers=workers)]
+    # Targets shared by the files are resolved once: the first link is checked as soon as it is found by the scan,
+    # the rest with a listing of the repo. Errors are reported for every file.
+    assert sorted(request[1] for request in server.requests) == [
+        "/repos/usr2/repo/git/trees/main?recursive=1",
+        "/usr2/repo/blob/main/nb.ipynb",
+    ]
+    for f, result in zip(files, results):
+        assert [record.file for record in result.records if record.name == "badge"] == [f.path]
+        assert result.blob is not None
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_process_files(tmp_path, file, badge, patterns, workers):
+    files = []
+    for name in string.ascii_lowercase:
+        file_path = tmp_path / f"{name}.md"
+        file_path.write_text("{{ badge }}\n")
+        files.append(file(path=str(file_path), type="md"))
+
+    results = [result.records for result in process_files(files, badge, patterns, verbose=True, workers=workers)]
+    assert len(results) == len(files)
+    for f, records in zip(files, results):
+        assert [record.name for record in records] == ["action", "badge", "action"]
+        assert [record.file for record in records if record.name == "badge"] == [f.path]
+        assert records[0].getMessage() == f"{f.path}: Reading..."